@@ -8,76 +8,259 @@ including layout serving, data processing, and interactive callbacks.
 
 Notes:
 - Cytoscape styling comes from styles.py; general page layout from layout.py and assets/styles.css.
+- Besides the dashboard, the Flask server answers `/api/graph` (the graph elements as JSON,
+  validated with an ETag of the graph version) and `/api/cache-stats` (the graph cache hit rate
+  and size seen by the worker answering).
 """
 
-from dash import Dash, Input, Output, State, no_update
+from dash import Dash, Input, Output, State, ctx, no_update
+from flask import Response, jsonify, request
 from styles import stylesheet as base_stylesheet
 import dash_cytoscape as cyto
 from layout import create_layout
 from data_processing import DataProcessor
-from utils import coalesce
+from graph_cache import create_cache
+from search_index import build_search_index
+from graph_analytics import GraphAnalytics
+from filters import clean_filters
+from utils import coalesce, to_snapshot_time, subgraph
+from collections import OrderedDict
+import hashlib
 import json
 import logging
+import os
 import sys
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
+# Filter inputs passed (in this order) to every callback that loads a graph
+FILTER_STATES = [
+    State("proto-filter", "value"),
+    State("state-filter", "value"),
+    State("port-filter", "value"),
+    State("stack-filter", "value"),
+    State("device-filter", "value"),
+]
+
+
+def make_filters(proto, state, ports, stacks, devices):
+    """Build the filters dictionary (see filters.py) from the values of FILTER_STATES."""
+    return clean_filters(
+        {"proto": proto, "state": state, "ports": ports, "stacks": stacks, "devices": devices}
+    )
+
 
 class DashApp:
-    def __init__(self, dev_mode=False, mask_ip_labels=True, hide_procs_with_no_inbound=True):
+    def __init__(
+        self,
+        dev_mode=False,
+        mask_ip_labels=True,
+        hide_procs_with_no_inbound=True,
+        cache=None,
+        data_source=None,
+    ):
         cyto.load_extra_layouts()  # This is needed to use advanced layouts like cola, spread, etc
-        self.limit = 100
         self.dev_mode = dev_mode
         self.app = Dash(__name__)
         self.data_processor = DataProcessor(
             dev_mode=dev_mode,
             mask_ip_labels=mask_ip_labels,
             hide_procs_with_no_inbound=hide_procs_with_no_inbound,
+            # "snapshots" (default) or "edges", when the collector runs with `mongo --edges`
+            data_source=data_source or os.environ.get("DOCKER_DASH_DATA_SOURCE", "snapshots"),
+            # Snapshots fetched per cursor batch, and the merge buffer size in MB before compacting
+            batch_size=int(os.environ.get("DOCKER_DASH_BATCH_SIZE", 200)),
+            merge_memory_limit=int(os.environ.get("DOCKER_DASH_MERGE_MEMORY_MB", 64)) * 1024 * 1024,
         )
-        self.layout_serve_count = 0  # Kind of a hacky workaround to avoid loading data from mongo on start. Need to find a better solution
+        # Processed graphs are shared between workers through the cache, so callbacks keep no state on self
+        self.cache = cache or create_cache()
+        # Per worker memo of recently used search indexes and analytics
+        self.derived = OrderedDict()
+        self.not_modified = 0  # Requests answered without a payload as the client was up to date
         self.app.layout = (
             self.serve_layout
         )  # Dynamically serve the layout to ensure fresh data on each load
-        self.elements = []
         self.register_callbacks()
+        self.register_routes()
 
     def serve_layout(self):
-        # Process container data for visualization
-
-        elements = None
-        if (
-            self.layout_serve_count > 1
-        ):  # Avoid calling process_container_data on the first layout serves dash performs (only load data once the user navigates to page)
-            child_nodes, parent_nodes, edges, containers, parent_names = (
-                self.data_processor.process_container_data(self.limit)
+        # The graph itself is loaded by update_snapshot_data once the page is opened, so serving
+        # the layout (which dash also does on start) never touches mongo
+        return create_layout(elements=[])
+
+    def graph_version(self, kind, *params):
+        """Return the version of a graph: its kind and parameters plus the newest snapshot id.
+
+        It only changes when a new snapshot is written and doubles as the cache key.
+        """
+        params_key = ":".join(json.dumps(p, sort_keys=True) for p in params)
+        return f"{kind}:{params_key}:{self.data_processor.latest_snapshot_id()}"
+
+    def load_graph(self, limit, filters=None, version=None):
+        """Return the graph for the latest `limit` snapshots and its version, processing it only
+        if no worker has cached it yet. Returns (graph, version).
+        """
+        version = version or self.graph_version("graph", limit, filters)
+        graph = self.cache.get(version)
+        if graph is None:
+            graph = self.store_graph(
+                version,
+                *self.data_processor.process_container_data(limit=limit, filters=filters),
+            )
+        return graph, version
+
+    def store_graph(self, version, child_nodes, parent_nodes, edges, containers, parent_names):
+        """Cache a processed graph, and the search index over its nodes, under version."""
+        graph = {
+            "elements": child_nodes + parent_nodes + edges,
+            "containers": containers,
+            "parent_names": parent_names,
+        }
+        self.cache.set(version, graph)
+        self.cache.set(f"search:{version}", build_search_index(graph["elements"], containers))
+        return graph
+
+    def load_diff_graph(self, split_time, limit, filters=None, version=None):
+        """Return the diff of the snapshots before and after split_time (see
+        DataProcessor.diff_container_data) and its version, like load_graph.
+        """
+        version = version or self.graph_version("diff", split_time, limit, filters)
+        graph = self.cache.get(version)
+        if graph is None:
+            graph = self.store_graph(
+                version,
+                *self.data_processor.diff_container_data(split_time, limit=limit, filters=filters),
             )
-            self.containers = containers
-            self.parent_names = parent_names
-            elements = child_nodes + parent_nodes + edges
-            # print("PARENT NODES")
-            # print(json.dumps(parent_nodes, indent=2))
-            # print("CHILD NODES")
-            # print(json.dumps(child_nodes, indent=2))
+        return graph, version
+
+    def parse_version(self, version):
+        """Return the kind and parameters of a graph version, and what follows them (the snapshot
+        id, or the base version of a focus). Raises ValueError if version isn't valid.
+        """
+        kind = version.partition(":")[0]
+        count = {"graph": 2, "diff": 3, "focus": 1}.get(kind)
+        if count is None:
+            raise ValueError(f"Unknown graph version: {version}")
+        decoder = json.JSONDecoder()
+        position = len(kind) + 1
+        params = []
+        for _ in range(count):
+            param, position = decoder.raw_decode(version, position)
+            params.append(param)
+            position += 1  # Skip the ":" after the parameter
+        return kind, params, version[position:]
+
+    def get_graph(self, version):
+        """Return the graph of a version, or None if version isn't valid.
+
+        A graph evicted from the cache is processed again from the parameters in its version
+        (with the newest snapshots, should new ones have been written since).
+        """
+        graph = self.cache.get(version)
+        if graph is not None:
+            return graph
+        try:
+            kind, params, rest = self.parse_version(version)
+            if kind == "focus":
+                base_kind, (limit, filters), _ = self.parse_version(rest)
+                if base_kind != "graph":
+                    return None
+            elif kind == "diff":
+                split_time, limit, filters = params
+            else:
+                limit, filters = params
+        except ValueError:
+            return None
+        if not isinstance(limit, int) or limit < 1 or not isinstance(filters, (dict, type(None))):
+            return None
+
+        if kind == "focus":
+            graph, _ = self.load_focus_graph(*params[0], limit, filters)
+        elif kind == "diff":
+            graph, _ = self.load_diff_graph(split_time, limit, filters)
+        else:
+            graph, _ = self.load_graph(limit, filters)
+        return graph
+
+    def focus_version(self, node_id, hops, direction, base_version):
+        """Return the version of the focus on node_id in the graph of base_version."""
+        return f"focus:{json.dumps([node_id, hops, direction])}:{base_version}"
+
+    def focus_params(self, version):
+        """Return the [node_id, hops, direction] a focus version was built with."""
+        return self.parse_version(version)[1][0]
+
+    def load_focus_graph(self, node_id, hops, direction, limit, filters=None, base_version=None):
+        """Return the part of the graph within hops edges of node_id (following edges in
+        direction, see GraphAnalytics.reachable) and its version, or (None, None) if node_id
+        isn't in the graph.
+        """
+        graph, base_version = self.load_graph(limit, filters, base_version)
+        version = self.focus_version(node_id, hops, direction, base_version)
+        focused = self.cache.get(version)
+        if focused is None:
+            # The graph may already have been evicted from the cache by other entries
+            analytics = self.get_analytics(base_version) or GraphAnalytics(graph["elements"])
+            if node_id not in analytics.index:
+                return None, None
+            node_ids = [node_id] + analytics.reachable(node_id, direction, max_hops=hops)
+            names = {id[3:] for id in node_ids if id.startswith("c__")}
+            focused = {
+                "elements": subgraph(graph["elements"], node_ids),
+                "containers": [c for c in graph["containers"] if c.get("name") in names],
+                "parent_names": graph["parent_names"],
+            }
+            self.cache.set(version, focused)
+        return focused, version
 
-        self.layout_serve_count += (
-            1  # Increment out layout serve counter so that we actually do get data
+    def get_derived(self, kind, version, build):
+        """Return the structure of a kind built from a graph version by build(graph), keeping
+        the last few in memory and sharing them with other workers through the cache.
+        """
+        key = f"{kind}:{version}"
+        value = self.derived.get(key)
+        if value is None:
+            value = self.cache.get(key)
+            if value is None:
+                graph = self.get_graph(version)
+                if graph is None:
+                    return None
+                value = build(graph)
+                self.cache.set(key, value)
+            self.derived[key] = value
+            while len(self.derived) > 8:
+                self.derived.popitem(last=False)
+        return value
+
+    def get_search_index(self, version):
+        """Return the search index of a graph version."""
+        return self.get_derived(
+            "search",
+            version,
+            lambda graph: build_search_index(graph["elements"], graph["containers"]),
+        )
+
+    def get_analytics(self, version):
+        """Return the GraphAnalytics of a graph version."""
+        return self.get_derived(
+            "analytics", version, lambda graph: GraphAnalytics(graph["elements"])
         )
-        # Set up the app layout with the generated elements
-        self.elements = elements
-        return create_layout(elements=elements)
 
     def register_callbacks(self):
         @self.app.callback(
             Output("cytoscape-tapNodeData-json", "children"),
             Input("cytoscape", "tapNodeData"),
+            State("graph-version", "data"),
             prevent_initial_call=True,
         )
-        def displayTapNodeData(data):
+        def displayTapNodeData(data, version):
             if data:
+                graph = (self.get_graph(version) if version else None) or {}
+                containers = graph.get("containers", [])
                 id = data.get("id")
                 id = id[3:]  # Remove prefix id
-                if id in self.parent_names:
-                    child_names = [c.get("name") for c in self.containers if c.get("stack") == id]
+                if id in graph.get("parent_names", []):
+                    child_names = [c.get("name") for c in containers if c.get("stack") == id]
                     return json.dumps(
                         {
                             "Container Stack": id,
@@ -87,52 +270,204 @@ class DashApp:
                         indent=2,
                     )
                 else:
-                    container = next((c for c in self.containers if c.get("name") == id), None)
-                    return json.dumps(coalesce(container, data), indent=2)
+                    container = next((c for c in containers if c.get("name") == id), None)
+                    details = dict(coalesce(container, data))
+                    analytics = self.get_analytics(version) if version else None
+                    details.update((analytics and analytics.node_summary(data.get("id"))) or {})
+                    return json.dumps(details, indent=2)
             else:
                 return "Click on a node to see additional details"
 
+        @self.app.callback(
+            Output("cytoscape-tapNodeData-json", "children", allow_duplicate=True),
+            Input("analytics-button", "n_clicks"),
+            State("graph-version", "data"),
+            prevent_initial_call=True,
+        )
+        def display_analytics(n_clicks, version):
+            analytics = self.get_analytics(version) if version else None
+            if analytics is None:
+                return "Load a graph to see its analytics"
+            return json.dumps(analytics.summary(), indent=2)
+
         @self.app.callback(
             Output("cytoscape", "elements"),
+            Output("graph-version", "data"),
             Input("apply-button", "n_clicks"),
             State("num-snapshots-input", "value"),
-            prevent_initial_call=True,
+            State("graph-version", "data"),
+            *FILTER_STATES,
         )
-        def update_snapshot_data(n_clicks, limit):
+        def update_snapshot_data(n_clicks, limit, client_version, *filter_values):
+            # Also runs when the page is opened to load the initial graph
             # If user supplied limit is invalid, return special signal to dash to not change output
             if not limit or not isinstance(limit, int) or limit < 1:
-                return no_update
+                return no_update, no_update
+            filters = make_filters(*filter_values)
+            version = self.graph_version("graph", limit, filters)
+            if client_version == version:
+                # The client already shows this graph, don't send it again
+                self.not_modified += 1
+                return no_update, no_update
+            graph, version = self.load_graph(limit, filters, version)
+            return graph["elements"], version
+
+        @self.app.callback(
+            Output("focus-node", "data"),
+            Input("cytoscape", "tapNodeData"),
+            Input("search-results", "data"),
+            prevent_initial_call=True,
+        )
+        def select_focus_node(data, node_ids):
+            # Focus on whichever was picked last: the clicked node or the first search result
+            if ctx.triggered_id == "search-results":
+                return node_ids[0] if node_ids else no_update
+            return data.get("id") if data else no_update
+
+        @self.app.callback(
+            Output("cytoscape", "elements", allow_duplicate=True),
+            Output("graph-version", "data", allow_duplicate=True),
+            Input("focus-button", "n_clicks"),
+            State("focus-node", "data"),
+            State("focus-hops", "value"),
+            State("focus-direction", "value"),
+            State("num-snapshots-input", "value"),
+            *FILTER_STATES,
+            prevent_initial_call=True,
+        )
+        def update_focus_data(n_clicks, node_id, hops, direction, limit, *filter_values):
+            # Only send the neighbourhood of the focused node instead of the whole graph
+            if not node_id or not hops or not isinstance(hops, int) or hops < 1:
+                return no_update, no_update
+            if not limit or not isinstance(limit, int) or limit < 1:
+                return no_update, no_update
+            graph, version = self.load_focus_graph(
+                node_id, hops, direction, limit, make_filters(*filter_values)
+            )
+            if graph is None:
+                return no_update, no_update
+            return graph["elements"], version
+
+        @self.app.callback(
+            Output("cytoscape", "elements", allow_duplicate=True),
+            Output("graph-version", "data", allow_duplicate=True),
+            Input("clear-focus-button", "n_clicks"),
+            State("num-snapshots-input", "value"),
+            *FILTER_STATES,
+            prevent_initial_call=True,
+        )
+        def clear_focus(n_clicks, limit, *filter_values):
+            if not limit or not isinstance(limit, int) or limit < 1:
+                return no_update, no_update
+            graph, version = self.load_graph(limit, make_filters(*filter_values))
+            return graph["elements"], version
+
+        @self.app.callback(
+            Output("stack-filter", "options"),
+            Output("device-filter", "options"),
+            Input("graph-version", "data"),
+        )
+        def update_filter_options(version):
+            return self.data_processor.filter_options()
+
+        @self.app.callback(
+            Output("live-interval", "disabled"),
+            Input("live-toggle", "value"),
+        )
+        def toggle_live(value):
+            return "live" not in (value or [])
+
+        @self.app.callback(
+            Output("cytoscape", "elements", allow_duplicate=True),
+            Output("graph-version", "data", allow_duplicate=True),
+            Input("live-interval", "n_intervals"),
+            State("graph-version", "data"),
+            State("num-snapshots-input", "value"),
+            *FILTER_STATES,
+            prevent_initial_call=True,
+        )
+        def update_live_data(n_intervals, client_version, limit, *filter_values):
+            # Poll for a new snapshot and only send a graph when the client's version is outdated
+            if not limit or not isinstance(limit, int) or limit < 1:
+                return no_update, no_update
+            filters = make_filters(*filter_values)
+            base_version = self.graph_version("graph", limit, filters)
+            if client_version and client_version.startswith("focus:"):
+                # Keep the focus, but move it to the newest graph
+                focus = self.focus_params(client_version)
+                if client_version == self.focus_version(*focus, base_version):
+                    return no_update, no_update
+                graph, version = self.load_focus_graph(*focus, limit, filters, base_version)
+                if graph is None:
+                    return no_update, no_update  # The focused node is gone, keep the last view
+            elif client_version and not client_version.startswith("graph:"):
+                # The client shows another view (e.g. a diff), don't replace it with the graph
+                return no_update, no_update
             else:
-                child_nodes, parent_nodes, edges, containers, parent_names = (
-                    self.data_processor.process_container_data(limit=limit)
+                if client_version == base_version:
+                    return no_update, no_update
+                graph, version = self.load_graph(limit, filters, base_version)
+
+            # Send the whole element list: cytoscape reconciles elements by id, so unchanged nodes
+            # keep their position. (A Patch can't remove elements by value, as dash-cytoscape
+            # writes its own {data, position} copies back to the elements prop.)
+            return graph["elements"], version
+
+        @self.app.callback(
+            Output("cytoscape", "elements", allow_duplicate=True),
+            Output("graph-version", "data", allow_duplicate=True),
+            Input("diff-button", "n_clicks"),
+            State("diff-time-input", "value"),
+            State("num-snapshots-input", "value"),
+            *FILTER_STATES,
+            prevent_initial_call=True,
+        )
+        def update_diff_data(n_clicks, split_time, limit, *filter_values):
+            # Compare the snapshots before the given time with the ones after it
+            split_time = to_snapshot_time(split_time)
+            if not split_time or not limit or not isinstance(limit, int) or limit < 1:
+                return no_update, no_update
+            else:
+                graph, version = self.load_diff_graph(
+                    split_time, limit, make_filters(*filter_values)
                 )
-                self.containers = containers
-                self.parent_names = parent_names
-                elements = child_nodes + parent_nodes + edges
-                self.elements = elements
-                return elements
+                return graph["elements"], version
 
         @self.app.callback(
             Output("export-graph", "data"),
             Input("export-button", "n_clicks"),
+            State("graph-version", "data"),
             prevent_initial_call=True,
         )
-        def export_snapshots(n_clicks):
-            if self.elements:
-                export_data = json.dumps(self.elements, indent=2)
+        def export_snapshots(n_clicks, version):
+            graph = self.get_graph(version) if version else None
+            if graph and graph["elements"]:
+                export_data = json.dumps(graph["elements"], indent=2)
                 return dict(content=export_data, filename="snapshots.json")
             else:
                 return None
 
-        # Client side callback for search/highlight so we don't send a POST request on every keystroke
+        @self.app.callback(
+            Output("search-results", "data"),
+            Input("node-search", "value"),
+            Input("graph-version", "data"),
+        )
+        def search_nodes(query, version):
+            # Look the query up in the server side index and only send back the matching node ids
+            if not query or not version:
+                return []
+            index = self.get_search_index(version)
+            return index.search(query) if index else []
+
+        # Client side callback so highlighting the matches doesn't need another round trip
         self.app.clientside_callback(
             """
-        function(searchValue, baseStyles) {
+        function(nodeIds, baseStyles) {
             const styles = JSON.parse(JSON.stringify(baseStyles));  // clone so we don’t mutate it
-            if (!searchValue) return styles;
+            if (!nodeIds || nodeIds.length === 0) return styles;
 
             styles.push({
-                selector: `node[label *= "${searchValue}"]`,
+                selector: nodeIds.map(id => `node[id = ${JSON.stringify(id)}]`).join(", "),
                 style: {
                 'background-color': '#04A1D2'
                 }
@@ -141,10 +476,53 @@ class DashApp:
         }
         """,
             Output("cytoscape", "stylesheet"),
-            Input("node-search", "value"),
+            Input("search-results", "data"),
             Input("base-styles", "data"),
         )
 
+    def register_routes(self):
+        server = self.app.server
+
+        def list_arg(name):
+            # Accept both repeated (?stacks=a&stacks=b) and comma separated (?stacks=a,b) values
+            return [v for value in request.args.getlist(name) for v in value.split(",") if v]
+
+        @server.route("/api/graph")
+        def api_graph():
+            limit = request.args.get("limit", 100, type=int)
+            if limit < 1:
+                return jsonify(error="limit must be a positive integer"), 400
+            filters = make_filters(
+                list_arg("proto"),
+                list_arg("state"),
+                request.args.get("ports"),
+                list_arg("stacks"),
+                list_arg("devices"),
+            )
+            version = self.graph_version("graph", limit, filters)
+            etag = hashlib.sha1(version.encode()).hexdigest()
+            if etag in request.if_none_match:
+                self.not_modified += 1
+                response = Response(status=304)
+            else:
+                graph, version = self.load_graph(limit, filters, version)
+                response = jsonify(version=version, elements=graph["elements"])
+            response.set_etag(etag)
+            return response
+
+        @server.route("/api/cache-stats")
+        def api_cache_stats():
+            stats = self.cache.stats()
+            lookups = stats["hits"] + stats["misses"]
+            stats.update(
+                {
+                    "pid": os.getpid(),
+                    "hit_rate": stats["hits"] / lookups if lookups else None,
+                    "not_modified": self.not_modified,
+                }
+            )
+            return jsonify(stats)
+
     def run(self):
         if self.dev_mode:
             print("Running in development mode")
@@ -0,0 +1,201 @@
+"""
+connection_store.py
+
+This module defines the ConnectionStore class, a columnar in-memory store for the
+connections merged from many snapshots in Docker Dash.
+
+Instead of keeping one dictionary per connection, every field value is interned to an
+integer code and each connection is kept as a single row of codes. Deduplication, grouping
+by device and inbound/outbound classification are then vectorized NumPy operations.
+
+Notes:
+- Rows are buffered in a flat `array('i')` while snapshots are merged and only turned into a
+  2D NumPy array (and deduplicated) by `finalize()`.
+- If `max_buffer_bytes` is set, the buffer is deduplicated into the rows merged so far whenever
+  it grows past that size (see `compact()`), so memory stays proportional to the number of
+  distinct connections rather than the number of snapshots merged.
+- Column 0 of every row is the device code. After `finalize()` rows are sorted, so the
+  connections of each device are one contiguous slice.
+- Fields missing from a connection are interned as a sentinel and left out again when the
+  connection is decoded, so decoded dictionaries have the same keys as the originals.
+- Keys that aren't in `fields` (e.g. a field newer collectors add) are not dropped: they are
+  interned together as one sorted tuple of items in a last, extra column.
+"""
+
+from array import array
+import numpy as np
+
+CONNECTION_FIELDS = (
+    "proto",
+    "local_address",
+    "local_ip",
+    "local_port",
+    "foreign_address",
+    "foreign_ip",
+    "foreign_port",
+    "state",
+    "pid_program_name",
+    "foreign_device",
+    "foreign_owner",
+)
+
+_MISSING = object()  # Placeholder for fields a connection does not have
+_PORT_RANGE = 65536  # Used to pack (device, port) pairs into a single integer key
+
+
+class Interner:
+    """Map hashable values to dense integer codes and back."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        """Return the code for value, assigning a new one if it hasn't been seen yet."""
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+
+def _as_port(value):
+    """Return value as an integer port, or -1 if it isn't one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+class ConnectionStore:
+    def __init__(self, fields=CONNECTION_FIELDS, max_buffer_bytes=None):
+        self.fields = fields
+        self.max_buffer_bytes = max_buffer_bytes
+        self.compactions = 0  # Number of compactions triggered by max_buffer_bytes
+        self.devices = Interner()
+        self.columns = [Interner() for _ in fields]
+        self.extras = Interner()  # Sorted (key, value) tuples of the keys not in fields
+        self.rows = np.empty((0, len(fields) + 2), dtype=np.intc)
+        self.inbound = np.empty(0, dtype=bool)
+        self._buffer = array("i")
+        self._listen_buffer = array("q")
+        self._listen_keys = np.empty(0, dtype=np.int64)
+        self._slices = {}
+        self._listen_ports = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, device, connections, listen_ports):
+        """Buffer the connections and listen ports of a device from one snapshot."""
+        device_code = self.devices.code(device)
+        buffer = self._buffer
+        columns = list(zip(self.fields, self.columns))
+        field_set = set(self.fields)
+        for connection in connections:
+            buffer.append(device_code)
+            present = 0
+            for field, column in columns:
+                value = connection.get(field, _MISSING)
+                if value is not _MISSING:
+                    present += 1
+                buffer.append(column.code(value))
+            extra = ()
+            if len(connection) > present:
+                extra = tuple(sorted((k, v) for k, v in connection.items() if k not in field_set))
+            buffer.append(self.extras.code(extra))
+
+        for port in listen_ports:
+            port = _as_port(port)
+            if port >= 0:
+                self._listen_buffer.extend((device_code, port))
+
+        if self.max_buffer_bytes and self.buffered_bytes() > self.max_buffer_bytes:
+            self.compact()
+            self.compactions += 1
+
+    def buffered_bytes(self):
+        """Return the size of the rows and listen ports buffered since the last compaction."""
+        return (
+            len(self._buffer) * self._buffer.itemsize
+            + len(self._listen_buffer) * self._listen_buffer.itemsize
+        )
+
+    def compact(self):
+        """Deduplicate the buffered rows into the rows merged so far and empty the buffer."""
+        width = len(self.fields) + 2
+        buffered = np.frombuffer(self._buffer, dtype=np.intc).reshape(-1, width)
+        if len(buffered):
+            self.rows = np.unique(np.concatenate([self.rows, buffered]), axis=0)
+
+        listen = np.frombuffer(self._listen_buffer, dtype=np.int64).reshape(-1, 2)
+        if len(listen):
+            keys = listen[:, 0] * _PORT_RANGE + listen[:, 1]
+            self._listen_keys = np.union1d(self._listen_keys, keys)
+
+        self._buffer = array("i")
+        self._listen_buffer = array("q")
+
+    def finalize(self):
+        """Deduplicate the buffered rows and classify each connection as inbound or outbound."""
+        self.compact()
+        rows = self.rows
+        listen_keys = self._listen_keys
+
+        self._listen_ports = {}
+        for key in listen_keys.tolist():
+            device_code, port = divmod(key, _PORT_RANGE)
+            self._listen_ports.setdefault(device_code, []).append(port)
+
+        if not len(rows):
+            self.inbound = np.empty(0, dtype=bool)
+            self._slices = {}
+            return self
+
+        # A connection is inbound when its local port is one the device listens on
+        port_column = self.columns[self.fields.index("local_port")]
+        port_values = np.array([_as_port(v) for v in port_column.values], dtype=np.int64)
+        local_ports = port_values[rows[:, self.fields.index("local_port") + 1]]
+        connection_keys = rows[:, 0].astype(np.int64) * _PORT_RANGE + local_ports
+        self.inbound = np.isin(connection_keys, listen_keys) & (local_ports >= 0)
+
+        # Rows are sorted by device code, so each device owns one contiguous slice
+        device_codes = rows[:, 0]
+        starts = np.flatnonzero(np.r_[True, device_codes[1:] != device_codes[:-1]])
+        stops = np.r_[starts[1:], len(rows)]
+        self._slices = {
+            code: (start, stop)
+            for code, start, stop in zip(
+                device_codes[starts].tolist(), starts.tolist(), stops.tolist()
+            )
+        }
+        return self
+
+    def _slice(self, device):
+        code = self.devices.codes.get(device)
+        return self._slices.get(code, (0, 0))
+
+    def connections(self, device):
+        """Return the distinct connections of a device as dictionaries."""
+        start, stop = self._slice(device)
+        values = [column.values for column in self.columns]
+        connections = []
+        for row in self.rows[start:stop, 1:].tolist():
+            connection = {}
+            for field, column_values, code in zip(self.fields, values, row):
+                value = column_values[code]
+                if value is not _MISSING:
+                    connection[field] = value
+            connection.update(self.extras.values[row[-1]])
+            connections.append(connection)
+        return connections
+
+    def inbound_flags(self, device):
+        """Return a list of booleans, aligned with connections(device), marking inbound ones."""
+        start, stop = self._slice(device)
+        return self.inbound[start:stop].tolist()
+
+    def listen_ports(self, device):
+        """Return the distinct listen ports of a device."""
+        return list(self._listen_ports.get(self.devices.codes.get(device), []))
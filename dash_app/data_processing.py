@@ -7,30 +7,72 @@ and transforming container and process data for visualization in Docker Dash.
 Notes:
 - All nodes and edges returned are compatible with Dash Cytoscape.
 - Node IDs are prefixed to distinguish types:
-    - 'c__' for containers, 'p__' for processes, 'i__' for IPs, 's__' for stacks.
+    - 'c__' for containers, 'p__' for processes, 'i__' for IPs, 's__' for stacks,
+      'o__' for owners of foreign IP ranges.
 - This module is independent of the Dash layout; it only prepares data for visualization.
 """
 
 import json
 import logging
 from pymongo import MongoClient
-from utils import make_node, make_edge, coalesce, anonymize_ip
+from utils import (
+    make_node,
+    make_edge,
+    coalesce,
+    anonymize_ip,
+    strip_connections,
+    add_classes,
+)
+from connection_store import ConnectionStore
+from ip_resolver import IPResolver, load_cidr_owners, GATEWAY_SUFFIX
+from filters import build_snapshot_pipeline, build_edge_query, clean_filters, ensure_indexes
 
 
 class DataProcessor:
-    def __init__(self, dev_mode=False, mask_ip_labels=True ,hide_procs_with_no_inbound=True):
+    def __init__(
+        self,
+        dev_mode=False,
+        mask_ip_labels=True,
+        hide_procs_with_no_inbound=True,
+        cidr_owners_path="cidr_owners.json",
+        data_source="snapshots",
+        batch_size=200,
+        merge_memory_limit=64 * 1024 * 1024,
+    ):
         conn_str = (
             "mongodb://localhost:27017/" if dev_mode else "mongodb://docker_dash_mongo:27017/"
         )
         self.client = MongoClient(conn_str)
         self.db = self.client["dashdb"]
         self.collection = self.db["snapshots"]
+        # Written by `dd.py mongo --edges` (see process_edge_data)
+        self.edges = self.db["edges"]
+        self.devices = self.db["devices"]
+        self.passes = self.db["passes"]
+        self.data_source = data_source
+        # Snapshots are streamed batch_size at a time; merged rows are compacted whenever the
+        # buffered ones exceed merge_memory_limit bytes (split between the two stores)
+        self.batch_size = batch_size
+        self.merge_memory_limit = merge_memory_limit
         self.mask_ip_labels = mask_ip_labels
         self.hide_procs_with_no_inbound = hide_procs_with_no_inbound
+        # User supplied CIDR -> owner ranges (VPCs, databases, partner ranges)
+        self.cidr_resolver = IPResolver(load_cidr_owners(cidr_owners_path))
+        self.indexes_ready = False
 
     def is_gateway(self, name):
         """Check to see if a foreign_device name is a gateway"""
-        return True if name and name.endswith(" (Gateway)") else False
+        return True if name and name.endswith(GATEWAY_SUFFIX) else False
+
+    def gateway_ip(self, resolver, *ips):
+        """Return the first of ips that is a docker network gateway."""
+        for ip in ips:
+            if resolver.gateways:
+                if resolver.is_gateway(ip):
+                    return ip
+            elif ip.endswith(".1"):  # Snapshots without network data, fall back to guessing
+                return ip
+        return None
 
     def load_container_data_json(self):
         """Load and return the container data from JSON."""
@@ -39,60 +81,228 @@ class DataProcessor:
             containers = json.load(f)
         return containers
 
-    def load_container_data_mongo(self, limit=None):
-        """Load and return the container data from MongoDB."""
+    def filter_options(self):
+        """Return the distinct stacks and container names in the snapshots, for the filter dropdowns."""
+        if self.data_source == "edges":
+            stacks = self.devices.distinct("stack", {"kind": "container"})
+            devices = self.devices.distinct("name")
+        else:
+            stacks = self.collection.distinct("host.devices.stack")
+            devices = self.collection.distinct("host.devices.name")
+        return sorted(s for s in stacks if s), sorted(d for d in devices if d)
+
+    def latest_snapshot_id(self):
+        """Return the id of the most recent snapshot (or pass) as a string, or None if there are none."""
+        collection = self.passes if self.data_source == "edges" else self.collection
+        doc = collection.find_one({}, projection={"_id": 1}, sort=[("snapshot_time", -1)])
+        return str(doc["_id"]) if doc else None
+
+    def load_container_data_mongo(self, limit=None, since=None, until=None, filters=None):
+        """Load and merge the container and process data from MongoDB.
+
+        If given, since/until restrict the snapshots to snapshot_time >= since and < until and
+        filters (see filters.py) restrict the devices and connections loaded.
+
+        Connections are merged into columnar ConnectionStores rather than lists of dictionaries,
+        so deduplication and inbound/outbound classification happen in a single vectorized pass.
+        Snapshots are streamed from a batched cursor and folded into the stores one at a time,
+        so memory is bounded by the distinct graph rather than the number of snapshots.
+        Returns the containers, the processes, the two stores and an IPResolver built from the
+        docker networks found in the snapshots.
+        """
         containers = {}
         processes = {}
+        max_buffer_bytes = self.merge_memory_limit // 2 if self.merge_memory_limit else None
+        container_store = ConnectionStore(max_buffer_bytes=max_buffer_bytes)
+        process_store = ConnectionStore(max_buffer_bytes=max_buffer_bytes)
+        resolver = IPResolver(fallback=self.cidr_resolver)
+        networks = set()
 
         # Get documents from MongoDB sort by most recent
         # Each document is a "snapshot" of the discovery script output at the time the script was ran, so we want most recent data first
 
-        docs = []
-        if limit:
-            docs = list(self.collection.find().sort("snapshot_time", -1).limit(limit))
-        else:
-            docs = list(self.collection.find().sort("snapshot_time", -1))
+        if not self.indexes_ready:
+            self.indexes_ready = ensure_indexes(self.collection)
 
-        logging.info("Mongo Documents Found: " + str(len(docs)))
-        for doc in docs:
+        # Filters are pushed down into the pipeline so mongo drops unwanted data before it reaches us
+        pipeline = build_snapshot_pipeline(limit=limit, since=since, until=until, filters=filters)
+        cursor = self.collection.aggregate(pipeline, batchSize=self.batch_size, allowDiskUse=True)
+
+        doc_count = 0
+        for doc in cursor:
+            doc_count += 1
             procs = doc["host"].get("processes", {})
             for k, v in procs.items():
                 if k not in processes:
-                    processes[k] = v
-                else:
-                    processes[k]["connections"].extend(v.get("connections", []))
+                    processes[k] = strip_connections(v)
+                process_store.add(k, v.get("connections", []), v.get("listen_ports", []))
 
             logging.info(f"Mongo Document ID: {doc['_id']}, Snapshot Time: {doc['snapshot_time']}")
+            for network in doc["host"].get("networks", []):
+                key = (network.get("name"), network.get("subnet"), network.get("gateway"))
+                if key not in networks:
+                    networks.add(key)
+                    resolver.add_network(*key)
+
             devices = doc["host"]["devices"]
             for dev in devices:
                 # id = dev['id'] # Use container ID as our identifier (old)
                 id = dev["name"]  # Use container Name (new)
                 if id not in containers:
-                    containers[id] = dev
-                else:
-                    # Merge connections and ports
-                    containers[id]["connections"].extend(dev.get("connections", []))
-                    containers[id]["listen_ports"].extend(dev.get("listen_ports", []))
+                    containers[id] = strip_connections(dev)
+                container_store.add(id, dev.get("connections", []), dev.get("listen_ports", []))
 
-        for c in containers.values():
-            c["connections"] = [
-                dict(t) for t in {tuple(sorted(d.items())) for d in c["connections"]}
-            ]
-            c["listen_ports"] = list(set(c["listen_ports"]))
+        logging.info("Mongo Documents Found: " + str(doc_count))
+        logging.info(
+            "Early merge compactions: "
+            + str(container_store.compactions + process_store.compactions)
+        )
+        container_store.finalize()
+        process_store.finalize()
+
+        for store, devices in [(container_store, containers), (process_store, processes)]:
+            for id, dev in devices.items():
+                dev["listen_ports"] = store.listen_ports(id)
+                dev["connections"] = store.connections(id)
 
         # print(json.dumps(containers.values(), indent=2, default=json_util.default))
-        return list(containers.values()), processes
+        return list(containers.values()), processes, container_store, process_store, resolver
+
+    def load_edge_data_mongo(self, limit=None, since=None, until=None, filters=None):
+        """Load the distinct edges and the container metadata written by `dd.py mongo --edges`.
+
+        limit is translated into the time of the limit-th most recent pass, so it selects the
+        edges seen in the same window as the last `limit` snapshots would. Returns (edges, containers).
+        """
+        if limit:
+            query = {"snapshot_time": {"$lt": until}} if until else {}
+            passes = list(
+                self.passes.find(query, {"snapshot_time": 1})
+                .sort("snapshot_time", -1)
+                .skip(limit - 1)
+                .limit(1)
+            )
+            if passes:
+                since = max(since or "", passes[0]["snapshot_time"])
+
+        filters = clean_filters(filters) or {}
+        stack_devices = None
+        if filters.get("stacks"):
+            stack_devices = self.devices.distinct(
+                "name", {"kind": "container", "stack": {"$in": filters["stacks"]}}
+            )
+        edges = list(self.edges.find(build_edge_query(since, until, filters, stack_devices)))
+        logging.info("Mongo Edges Found: " + str(len(edges)))
+
+        # Only the containers seen in the same window as the edges, like snapshot mode
+        query = {"kind": "container"}
+        if since:
+            query["last_seen"] = {"$gte": since}
+        if until:
+            query["first_seen"] = {"$lt": until}
+        if filters.get("stacks"):
+            query["stack"] = {"$in": filters["stacks"]}
+        if filters.get("devices"):
+            query["name"] = {"$in": filters["devices"]}
+        containers = list(self.devices.find(query, {"_id": 0, "host": 0, "kind": 0}))
+        return edges, containers
+
+    def process_edge_data(self, limit=None, since=None, until=None, filters=None):
+        """Build the graph from the edges collection. Returns the same tuple as process_container_data."""
+        edges, containers = self.load_edge_data_mongo(
+            limit=limit, since=since, until=until, filters=filters
+        )
+        stacks = {c.get("name"): c.get("stack") for c in containers}
+
+        parent_nodes = []
+        parent_names = []
+        child_nodes = []
+        node_ids = set()
+        edge_elements = []
+        edge_ids = set()
+        owner_names = set()
+
+        def add_node(key, kind, label=None, owner=None):
+            """Add the node for one end of an edge if needed and return its id."""
+            parent = None
+            if kind == "container":
+                id, classes, label = f"c__{key}", "graph-node docker-container", key
+                parent = f"s__{stacks[key]}" if stacks.get(key) else None
+            elif kind == "process":
+                id, classes, label = f"p__{key}", "graph-node process", key
+            elif kind == "gateway":
+                id, classes, label = f"i__{key}", "graph-node docker-gateway-ip", label or key
+            else:
+                id, classes = f"i__{key}", "graph-node foreign-ip"
+                label = anonymize_ip(key) if self.mask_ip_labels else key
+                owner = coalesce(owner, self.cidr_resolver.lookup(key))
+                if owner:
+                    parent = f"o__{owner}"
+                    if owner not in owner_names:
+                        owner_names.add(owner)
+                        parent_nodes.append(make_node(id=parent, label=owner, classes="owners"))
+            if id not in node_ids:
+                node_ids.add(id)
+                child_nodes.append(make_node(id=id, label=label, classes=classes, parent=parent))
+            return id
+
+        for container in containers:
+            name = container.get("name")
+            stack = container.get("stack")
+            if stack and stack not in parent_names:
+                parent_names.append(stack)
+                parent_nodes.append(make_node(id=f"s__{stack}", label=stack, classes="stacks"))
+            add_node(name, "container")
+
+        # Only add processes that have at least one inbound edge
+        inbound_processes = {e["target"] for e in edges if e.get("target_kind") == "process"}
+        for e in edges:
+            if self.hide_procs_with_no_inbound and any(
+                e.get(f"{end}_kind") == "process" and e[end] not in inbound_processes
+                for end in ("source", "target")
+            ):
+                continue
+            ends = []
+            for end in ("source", "target"):
+                kind = e.get(f"{end}_kind")
+                if kind == "container" and e[end] not in stacks:
+                    stacks[e[end]] = None  # Container seen in an edge but filtered out or gone
+                ends.append(add_node(e[end], kind, e.get("peer_label"), e.get("owner")))
+
+            edge_id = f"{e['source']}{e['target']}"
+            if edge_id not in edge_ids:
+                edge_ids.add(edge_id)
+                edge_elements.append(make_edge(id=edge_id, source=ends[0], target=ends[1]))
+
+        return child_nodes, parent_nodes, edge_elements, containers, parent_names
+
+    def process_container_data(self, limit=None, since=None, until=None, filters=None):
+        if self.data_source == "edges":
+            return self.process_edge_data(limit=limit, since=since, until=until, filters=filters)
 
-    def process_container_data(self, limit=None):
         # containers = self.load_container_data_json()
-        containers, processes = self.load_container_data_mongo(limit=limit)
+        containers, processes, container_store, process_store, resolver = (
+            self.load_container_data_mongo(limit=limit, since=since, until=until, filters=filters)
+        )
 
         parent_nodes = []
         parent_names = []
         child_nodes = []
-        child_names = []
+        child_names = set()
         edges = []
-        edge_ids = []
+        edge_ids = set()
+        owner_names = set()
+        peer_names = {}  # Containers at the other end of a container to container connection
+
+        def owner_parent(connection, foreign_ip):
+            """Return the owner node id for a foreign ip, adding the owner node if needed."""
+            owner = coalesce(connection.get("foreign_owner"), resolver.lookup(foreign_ip))
+            if not owner:
+                return None
+            if owner not in owner_names:
+                owner_names.add(owner)
+                parent_nodes.append(make_node(id=f"o__{owner}", label=owner, classes="owners"))
+            return f"o__{owner}"
 
         # Process Processes
         for k, v in processes.items():
@@ -101,15 +311,14 @@ class DataProcessor:
             node_a = make_node(id=f"p__{k}", label=k, classes="graph-node process")
 
             connections = v.get("connections", [])
-            listen_ports = v.get("listen_ports", [])
+            inbound_flags = process_store.inbound_flags(k)
 
             # Only add this process if it has at least one inbound connection
             if self.hide_procs_with_no_inbound:
-                has_inbound = any(c.get("local_port") in listen_ports for c in connections)
-                if not has_inbound:
+                if not any(inbound_flags):
                     continue  # skip this process entirely
 
-            for c in connections:
+            for c, is_inbound in zip(connections, inbound_flags):
                 foreign_device = c.get("foreign_device", None)
                 foreign_ip = c.get("foreign_ip")
                 local_ip = c.get("local_ip")
@@ -118,6 +327,7 @@ class DataProcessor:
                 id = ""
                 classes_string = "graph-node "
                 label = ""
+                parent = None
 
                 # If we have a value for foreign_device it is either a container or docker gateway
                 if foreign_device:
@@ -125,10 +335,7 @@ class DataProcessor:
                     key = None
 
                     # We do a check to see which IP is the one that actually corresponds with the gateway
-                    if int(local_ip[-1]) == 1:
-                        key = local_ip
-                    elif int(foreign_ip[-1]) == 1:
-                        key = foreign_ip
+                    key = coalesce(self.gateway_ip(resolver, local_ip, foreign_ip), local_ip)
 
                     # Check if it the device is a gateway or not
                     if self.is_gateway(foreign_device):
@@ -146,15 +353,17 @@ class DataProcessor:
                     classes_string += "foreign-ip" if foreign_ip != "127.0.0.1" else "docker-gateway-ip"
                     label = foreign_ip
                     key = foreign_ip
+                    parent = owner_parent(c, foreign_ip)
 
                 node_b = make_node(
                     id=id,
                     label=label,
                     classes=classes_string,
+                    parent=parent,
                 )
 
                 # Determine edge direction
-                if c.get("local_port") in listen_ports:
+                if is_inbound:
                     # inbound
                     source_node = node_b
                     target_node = node_a
@@ -164,29 +373,28 @@ class DataProcessor:
                     source_node = node_a
                     target_node = node_b
                     edge_id = source_node["data"]["label"] + key
+                # Add nodes if they haven't been added yet
+                for node_key, node in [(k, node_a), (key, node_b)]:
+                    if node_key not in child_names:
+                        child_nodes.append(node)
+                        child_names.add(node_key)
+
+                # Append edge if it is not already present
                 if edge_id not in edge_ids:
                     edge = make_edge(
                         id=edge_id,
                         source=source_node["data"]["id"],
                         target=target_node["data"]["id"],
                     )
-
-                # Add nodes if they haven't been added yet
-                for node_key, node in [(k, node_a), (key, node_b)]:
-                    if node_key not in child_names:
-                        child_nodes.append(node)
-                        child_names.append(node_key)
-
-                # Append edge
-                edges.append(edge)
-                edge_ids.append(edge_id)
+                    edges.append(edge)
+                    edge_ids.add(edge_id)
 
         # Process Containers
         for container in containers:
             name = container.get("name")
             parent_name = container.get("stack")
             connections = container.get("connections")
-            listen_ports = container.get("listen_ports")
+            inbound_flags = container_store.inbound_flags(name)
 
             if parent_name:
                 parent_node = make_node(id=f"s__{parent_name}", label=parent_name, classes="stacks")
@@ -203,11 +411,10 @@ class DataProcessor:
                 parent_nodes.append(parent_node)
 
             child_nodes.append(child_node)
-            child_names.append(name)
+            child_names.add(name)
 
-            for connection in connections:
+            for connection, is_inbound in zip(connections, inbound_flags):
                 foreign_device = connection.get("foreign_device")
-                local_port = int(connection.get("local_port"))
                 edge = None
 
                 is_gateway = self.is_gateway(foreign_device)
@@ -216,7 +423,7 @@ class DataProcessor:
                 if not foreign_device or is_gateway:
                     foreign_ip = connection.get("foreign_ip")
                     if foreign_ip not in child_names:
-                        child_names.append(foreign_ip)
+                        child_names.add(foreign_ip)
                         child_node = make_node(
                             id=f"i__{foreign_ip}",
                             label=coalesce(
@@ -224,10 +431,11 @@ class DataProcessor:
                                 (anonymize_ip(foreign_ip) if self.mask_ip_labels else foreign_ip),
                             ),
                             classes=f"graph-node {node_class}",
+                            parent=None if is_gateway else owner_parent(connection, foreign_ip),
                         )
                         child_nodes.append(child_node)
 
-                    if local_port in listen_ports:
+                    if is_inbound:
                         edge = make_edge(
                             id=foreign_ip + name,
                             source=f"i__{foreign_ip}",
@@ -242,7 +450,8 @@ class DataProcessor:
 
                 # Container to container connection processing
                 else:
-                    if local_port in listen_ports:
+                    peer_names[foreign_device] = True
+                    if is_inbound:
                         edge = make_edge(
                             id=foreign_device + name,
                             source=f"c__{foreign_device}",
@@ -259,8 +468,62 @@ class DataProcessor:
                 if edge:
                     edge_id = edge.get("data").get("id")
                     if edge_id not in edge_ids:
-                        edge_ids.append(edge_id)
+                        edge_ids.add(edge_id)
                         edges.append(edge)
+
+        # Peers that were filtered out (or are gone) still need a node for their edges to end at
+        for peer in peer_names:
+            if peer not in child_names:
+                child_names.add(peer)
+                child_nodes.append(
+                    make_node(id=f"c__{peer}", label=peer, classes="graph-node docker-container")
+                )
         # parent_names.append('EXTERNAL')
         # parent_nodes.append(make_node(id='__EXTERNAL__', label='EXTERNAL', classes='stacks'))
         return child_nodes, parent_nodes, edges, containers, parent_names
+
+    def diff_container_data(self, split_time, limit=None, filters=None):
+        """Compare the graph of the `limit` snapshots before split_time with the graph of the
+        `limit` most recent snapshots from split_time on.
+
+        Nodes are compared by id and edges by their (source, target) pair with set operations
+        (edge ids are display ids that don't encode the direction), and every element gets a
+        'diff-added', 'diff-removed' or 'diff-unchanged' class. Returns the same tuple as
+        process_container_data, with the elements of both windows combined.
+        """
+        before = self.process_container_data(limit=limit, until=split_time, filters=filters)
+        after = self.process_container_data(limit=limit, since=split_time, filters=filters)
+
+        def node_key(element):
+            return element["data"]["id"]
+
+        def edge_key(element):
+            return (element["data"]["source"], element["data"]["target"])
+
+        def diff_elements(before_elements, after_elements, key):
+            before_by_key = {key(e): e for e in before_elements}
+            after_by_key = {key(e): e for e in after_elements}
+            added = after_by_key.keys() - before_by_key.keys()
+            removed = before_by_key.keys() - after_by_key.keys()
+
+            elements = []
+            for k, element in after_by_key.items():
+                diff_class = "diff-added" if k in added else "diff-unchanged"
+                elements.append(add_classes(element, diff_class))
+            after_ids = {e["data"]["id"] for e in after_elements}
+            for k in removed:
+                element = add_classes(before_by_key[k], "diff-removed")
+                if element["data"]["id"] in after_ids:
+                    # E.g. the edge reversed direction, keep both on the graph under distinct ids
+                    element["data"] = {**element["data"], "id": element["data"]["id"] + "__removed"}
+                elements.append(element)
+            return elements
+
+        child_nodes = diff_elements(before[0], after[0], node_key)
+        parent_nodes = diff_elements(before[1], after[1], node_key)
+        edges = diff_elements(before[2], after[2], edge_key)
+
+        container_names = {c.get("name") for c in after[3]}
+        containers = after[3] + [c for c in before[3] if c.get("name") not in container_names]
+        parent_names = after[4] + [p for p in before[4] if p not in after[4]]
+        return child_nodes, parent_nodes, edges, containers, parent_names
@@ -0,0 +1,214 @@
+"""
+filters.py
+
+This module translates the dashboard filters (protocol, connection state, port ranges, stacks
+and devices) into a MongoDB aggregation pipeline, so unwanted snapshots, devices and connections
+are dropped by MongoDB before any document reaches Python.
+
+Notes:
+- Filters are passed around as a dictionary with the optional keys "proto", "state", "stacks",
+  "devices" (lists of values) and "ports" (a string such as "80,443,8000-9000").
+- A port range matches a connection if either its local or its foreign port falls in it.
+- Processes have no stack, so they are dropped entirely when filtering by stack. Their
+  connections come from `ss ... state established`, so a missing state counts as ESTABLISHED.
+- Stack and device filters are also part of the initial $match, so the indexes on
+  host.devices.stack / host.devices.name narrow down the snapshots read. The device dropdown
+  lists containers, so snapshots in which only a process has a filtered name are skipped.
+"""
+
+import logging
+import pymongo
+
+PROTOCOLS = ["tcp", "tcp6", "udp", "udp6"]
+STATES = [
+    "CLOSE_WAIT",
+    "CLOSED",
+    "ESTABLISHED",
+    "FIN_WAIT_1",
+    "FIN_WAIT_2",
+    "LAST_ACK",
+    "LISTEN",
+    "SYN_RECEIVED",
+    "SYN_SEND",
+    "TIME_WAIT",
+]
+
+
+def ensure_indexes(collection):
+    """Create the indexes the snapshot window and filter predicates rely on."""
+    try:
+        collection.create_index([("snapshot_time", pymongo.DESCENDING)])
+        collection.create_index("host.devices.stack")
+        collection.create_index("host.devices.name")
+        return True
+    except pymongo.errors.PyMongoError as e:
+        logging.warning(f"Could not create snapshot indexes: {e}")
+        return False
+
+
+def parse_port_ranges(value):
+    """Parse "80,443,8000-9000" into [(80, 80), (443, 443), (8000, 9000)], skipping bad parts."""
+    ranges = []
+    for part in (value or "").split(","):
+        bounds = part.strip().split("-")
+        try:
+            low = int(bounds[0])
+            high = int(bounds[-1])
+        except ValueError:
+            continue
+        if len(bounds) <= 2:
+            ranges.append((min(low, high), max(low, high)))
+    return ranges
+
+
+def clean_filters(filters):
+    """Return filters without empty values, or None if nothing is left to filter on."""
+    cleaned = {k: v for k, v in (filters or {}).items() if v}
+    if "ports" in cleaned and not parse_port_ranges(cleaned["ports"]):
+        del cleaned["ports"]
+    return cleaned or None
+
+
+def _port_in_ranges(port, ranges):
+    value = {"$convert": {"input": port, "to": "int", "onError": -1, "onNull": -1}}
+    return {
+        "$or": [{"$and": [{"$gte": [value, low]}, {"$lte": [value, high]}]} for low, high in ranges]
+    }
+
+
+def _connection_condition(filters, connection):
+    """Build the $filter condition keeping the connections that match filters."""
+    conditions = []
+    if filters.get("proto"):
+        conditions.append({"$in": [f"{connection}.proto", filters["proto"]]})
+    if filters.get("state"):
+        state = {"$ifNull": [f"{connection}.state", "ESTABLISHED"]}
+        conditions.append({"$in": [state, filters["state"]]})
+    ranges = parse_port_ranges(filters.get("ports"))
+    if ranges:
+        conditions.append(
+            {
+                "$or": [
+                    _port_in_ranges(f"{connection}.local_port", ranges),
+                    _port_in_ranges(f"{connection}.foreign_port", ranges),
+                ]
+            }
+        )
+    return {"$and": conditions} if conditions else None
+
+
+def _filter_connections(filters, connections):
+    condition = _connection_condition(filters, "$$c")
+    if condition is None:
+        return connections
+    return {"$filter": {"input": {"$ifNull": [connections, []]}, "as": "c", "cond": condition}}
+
+
+def _devices_expression(filters):
+    device_conditions = []
+    if filters.get("stacks"):
+        device_conditions.append({"$in": ["$$d.stack", filters["stacks"]]})
+    if filters.get("devices"):
+        device_conditions.append({"$in": ["$$d.name", filters["devices"]]})
+    devices = {"$ifNull": ["$host.devices", []]}
+    if device_conditions:
+        devices = {"$filter": {"input": devices, "as": "d", "cond": {"$and": device_conditions}}}
+
+    connections = _filter_connections(filters, "$$d.connections")
+    if connections == "$$d.connections":
+        return devices
+    return {
+        "$map": {
+            "input": devices,
+            "as": "d",
+            "in": {"$mergeObjects": ["$$d", {"connections": connections}]},
+        }
+    }
+
+
+def _processes_expression(filters):
+    if filters.get("stacks"):
+        return {"$literal": {}}
+    processes = {"$objectToArray": {"$ifNull": ["$host.processes", {}]}}
+    if filters.get("devices"):
+        processes = {
+            "$filter": {
+                "input": processes,
+                "as": "p",
+                "cond": {"$in": ["$$p.k", filters["devices"]]},
+            }
+        }
+    connections = _filter_connections(filters, "$$p.v.connections")
+    return {
+        "$arrayToObject": {
+            "$map": {
+                "input": processes,
+                "as": "p",
+                "in": {
+                    "k": "$$p.k",
+                    "v": {"$mergeObjects": ["$$p.v", {"connections": connections}]},
+                },
+            }
+        }
+    }
+
+
+def build_snapshot_pipeline(limit=None, since=None, until=None, filters=None):
+    """Build the aggregation pipeline returning the snapshots to merge, most recent first."""
+    match = {}
+    if since or until:
+        match["snapshot_time"] = {}
+        if since:
+            match["snapshot_time"]["$gte"] = since
+        if until:
+            match["snapshot_time"]["$lt"] = until
+
+    filters = clean_filters(filters)
+    if filters and filters.get("stacks"):
+        match["host.devices.stack"] = {"$in": filters["stacks"]}
+    if filters and filters.get("devices"):
+        match["host.devices.name"] = {"$in": filters["devices"]}
+
+    pipeline = []
+    if match:
+        pipeline.append({"$match": match})
+    pipeline.append({"$sort": {"snapshot_time": -1}})
+    if limit:
+        pipeline.append({"$limit": limit})
+    if filters:
+        pipeline.append(
+            {
+                "$set": {
+                    "host.devices": _devices_expression(filters),
+                    "host.processes": _processes_expression(filters),
+                }
+            }
+        )
+    return pipeline
+
+
+def build_edge_query(since=None, until=None, filters=None, stack_devices=None):
+    """Build the find() query for the edges collection (see `dd.py mongo --edges`).
+
+    An edge is in the window if it was first seen before until and last seen at or after since.
+    stack_devices are the names of the containers in the filtered stacks. Edges have no
+    connection state, so the state filter does not apply to them.
+    """
+    conditions = []
+    if since:
+        conditions.append({"last_seen": {"$gte": since}})
+    if until:
+        conditions.append({"first_seen": {"$lt": until}})
+
+    filters = clean_filters(filters) or {}
+    if filters.get("proto"):
+        conditions.append({"proto": {"$in": filters["proto"]}})
+    ranges = parse_port_ranges(filters.get("ports"))
+    if ranges:
+        conditions.append({"$or": [{"port": {"$gte": low, "$lte": high}} for low, high in ranges]})
+    for names in [stack_devices if filters.get("stacks") else None, filters.get("devices")]:
+        if names is not None:
+            conditions.append(
+                {"$or": [{"source": {"$in": list(names)}}, {"target": {"$in": list(names)}}]}
+            )
+    return {"$and": conditions} if conditions else {}
@@ -0,0 +1,167 @@
+"""
+graph_analytics.py
+
+This module defines the GraphAnalytics class, which answers questions about a processed graph
+(top talkers, fan-in/fan-out, connected components, reachability and isolated stacks) for the
+analytics panel and the node details in Docker Dash.
+
+The edges of the graph are kept as a sparse adjacency matrix in CSR form (an `indptr` array of
+row offsets and an `indices` array of column indices), built once per graph with NumPy. Degrees
+are then a difference of offsets, components are found by vectorized label propagation and
+reachability is a breadth first search expanding a whole frontier per step.
+
+Notes:
+- Only leaf nodes (containers, processes and IPs) are vertices; compound nodes (stacks and IP
+  owners) are only used to group vertices, e.g. to find isolated stacks.
+- An edge points from the connecting side to the listening side, so fan-in counts the distinct
+  clients of a node and the blast radius of a node is everything that reaches it.
+- Analytics are built lazily per graph version and stored in the graph cache (see app.py).
+"""
+
+import numpy as np
+
+
+def _csr(rows, columns, size):
+    """Return (indptr, indices) of the sparse matrix with a 1 at every (row, column)."""
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, columns[order]
+
+
+def _expand(indptr, indices, frontier):
+    """Return the column indices of every row in frontier (with repeats)."""
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    total = counts.sum()
+    if not total:
+        return np.empty(0, dtype=indices.dtype)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return indices[np.repeat(starts, counts) + offsets]
+
+
+class GraphAnalytics:
+    def __init__(self, elements):
+        parents = {}
+        labels = {}
+        edges = []
+        for element in elements:
+            data = element["data"]
+            if element.get("group") == "edges":
+                edges.append((data["source"], data["target"]))
+            else:
+                labels[data["id"]] = data.get("label") or data["id"]
+                parents[data["id"]] = data.get("parent")
+
+        # Compound nodes are the ones other nodes point to as their parent
+        compound = set(parents.values())
+        self.node_ids = [id for id in labels if id not in compound]
+        self.labels = [labels[id] for id in self.node_ids]
+        self.index = {id: i for i, id in enumerate(self.node_ids)}
+        size = len(self.node_ids)
+
+        pairs = [
+            (self.index[s], self.index[t])
+            for s, t in edges
+            if s in self.index and t in self.index and s != t
+        ]
+        pairs = np.unique(np.array(pairs, dtype=np.int64).reshape(-1, 2), axis=0)
+        self.sources, self.targets = pairs[:, 0], pairs[:, 1]
+        self.out_indptr, self.out_indices = _csr(self.sources, self.targets, size)
+        self.in_indptr, self.in_indices = _csr(self.targets, self.sources, size)
+        self.fan_out = np.diff(self.out_indptr)
+        self.fan_in = np.diff(self.in_indptr)
+
+        # Stack code of every vertex (-1 if it isn't in a stack)
+        stacks = sorted({p for p in parents.values() if p and p.startswith("s__")})
+        self.stacks = [s[3:] for s in stacks]
+        stack_codes = {s: i for i, s in enumerate(stacks)}
+        self.stack_of = np.array(
+            [stack_codes.get(parents[id], -1) for id in self.node_ids], dtype=np.int64
+        )
+        self.components = self._components()
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def _components(self):
+        """Label every vertex with the smallest index in its (weakly) connected component."""
+        labels = np.arange(len(self.node_ids))
+        while True:
+            previous = labels
+            labels = labels.copy()
+            np.minimum.at(labels, self.sources, labels[self.targets])
+            np.minimum.at(labels, self.targets, labels[self.sources])
+            labels = labels[labels]  # Pointer jumping to speed up propagation along paths
+            if np.array_equal(labels, previous):
+                return labels
+
+    def reachable(self, node_id, direction="out", max_hops=None):
+        """Return the ids of the nodes reachable from node_id, excluding itself.
+
+        direction is "out" (following edges), "in" (against them) or "both". max_hops limits the
+        search to that many edges away from node_id.
+        """
+        start = self.index.get(node_id)
+        if start is None:
+            return []
+        visited = np.zeros(len(self.node_ids), dtype=bool)
+        visited[start] = True
+        frontier = np.array([start])
+        hops = 0
+        while len(frontier) and (max_hops is None or hops < max_hops):
+            neighbours = []
+            if direction in ("out", "both"):
+                neighbours.append(_expand(self.out_indptr, self.out_indices, frontier))
+            if direction in ("in", "both"):
+                neighbours.append(_expand(self.in_indptr, self.in_indices, frontier))
+            frontier = np.unique(np.concatenate(neighbours))
+            frontier = frontier[~visited[frontier]]
+            visited[frontier] = True
+            hops += 1
+        visited[start] = False
+        return [self.node_ids[i] for i in np.flatnonzero(visited)]
+
+    def isolated_stacks(self):
+        """Return the stacks with no edge into or out of the stack (only edges between its members)."""
+        source_stacks = self.stack_of[self.sources]
+        target_stacks = self.stack_of[self.targets]
+        crossing = source_stacks != target_stacks
+        connected = np.union1d(source_stacks[crossing], target_stacks[crossing])
+        return [s for i, s in enumerate(self.stacks) if i not in connected]
+
+    def _ranking(self, values, top):
+        order = np.argsort(-values, kind="stable")[:top]
+        return [{self.labels[i]: int(values[i])} for i in order if values[i] > 0]
+
+    def summary(self, top=10):
+        """Return the analytics panel contents: rankings, components and isolated stacks."""
+        roots, sizes = np.unique(self.components, return_counts=True)
+        largest = np.argsort(-sizes, kind="stable")[:top]
+        return {
+            "Nodes": len(self.node_ids),
+            "Edges": len(self.sources),
+            "Top Fan-in": self._ranking(self.fan_in, top),
+            "Top Fan-out": self._ranking(self.fan_out, top),
+            "Top Degree": self._ranking(self.fan_in + self.fan_out, top),
+            "Connected Components": len(roots),
+            "Largest Components": [
+                {
+                    "Size": int(sizes[i]),
+                    "Example": self.labels[roots[i]],
+                }
+                for i in largest
+            ],
+            "Isolated Stacks": self.isolated_stacks(),
+        }
+
+    def node_summary(self, node_id):
+        """Return the fan-in, fan-out and blast radius of a node, or None if it isn't a vertex."""
+        i = self.index.get(node_id)
+        if i is None:
+            return None
+        return {
+            "Fan-in": int(self.fan_in[i]),
+            "Fan-out": int(self.fan_out[i]),
+            "Blast Radius": len(self.reachable(node_id, direction="in")),
+        }
@@ -0,0 +1,200 @@
+"""
+graph_cache.py
+
+This module defines the shared cache processed graphs are kept in, so every worker serving
+Docker Dash can reuse (and serve callbacks for) a graph built by any other worker.
+
+Two backends are available:
+- DiskCache: pickled entries in a local directory (in /dev/shm when available, so it is
+  effectively shared memory). Works across gunicorn workers on one host with no extra services.
+  The directory must be owned by, and only accessible to, the user running Docker Dash, since
+  loading a pickle can run arbitrary code.
+- RedisCache: entries in Redis, for sharing across hosts. Requires the optional `redis` package.
+
+Notes:
+- Cache keys are plain strings built from the query parameters and the newest snapshot id, so a
+  cached graph never goes stale; old entries are simply evicted.
+- `create_cache()` picks the backend from the DOCKER_DASH_REDIS_URL / DOCKER_DASH_CACHE_DIR
+  environment variables.
+- DiskCache is bounded by entry count and total size (DOCKER_DASH_CACHE_MAX_MB, 32 MB by default,
+  half of the 64 MB /dev/shm docker gives a container). A write that fails, e.g. because the
+  filesystem is full, is logged and skipped; the graph is simply processed again next time.
+- Both backends count their hits and misses (per worker) and report them, with the size of the
+  cache, through `stats()`.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+
+def _default_cache_dir():
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"docker-dash-cache-{os.getuid()}")
+
+
+def _make_private_dir(directory):
+    """Create directory readable and writable by the current user only, or check that an
+    existing one is. Raises PermissionError if another user owns it or can write to it.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    stat = os.lstat(directory)
+    if not os.path.isdir(directory) or os.path.islink(directory):
+        raise PermissionError(f"{directory} is not a directory")
+    if stat.st_uid != os.getuid():
+        raise PermissionError(f"{directory} is owned by another user")
+    if stat.st_mode & 0o077:
+        raise PermissionError(f"{directory} is accessible by other users")
+
+
+class DiskCache:
+    def __init__(self, directory=None, max_entries=64, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            _make_private_dir(directory)  # A configured directory has to be fixed by hand
+            self.directory = directory
+        else:
+            self.directory = _default_cache_dir()
+            try:
+                _make_private_dir(self.directory)
+            except PermissionError as e:
+                # Don't load pickles another user could have written; this cache is then not
+                # shared with the other workers, which simply process their own graphs
+                logging.warning(f"Not using {self.directory} for the graph cache: {e}")
+                self.directory = tempfile.mkdtemp(prefix="docker-dash-cache-")
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".pickle")
+
+    def get(self, key):
+        """Return the value stored under key, or None."""
+        try:
+            with open(self._path(key), "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store value under key. Writes are atomic so readers never see a partial entry."""
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logging.warning(f"Could not write {key} to the graph cache: {e}")
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        self._prune(keep=self._path(key))
+
+    def _prune(self, keep=None):
+        """Remove the least recently written entries beyond max_entries or max_bytes, except the
+        entry at path keep (the one just written, even if it alone is over max_bytes).
+        """
+        entries = []
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".pickle"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # Pruned by another worker
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            logging.warning(f"Could not prune the graph cache: {e}")
+            return
+
+        entries.sort(reverse=True)  # Newest first
+        total = 0
+        for i, (mtime, size, path) in enumerate(entries):
+            total += size
+            if path == keep:
+                continue
+            if i >= self.max_entries or (self.max_bytes and total > self.max_bytes):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # Another worker pruned the same entry first
+
+    def stats(self):
+        """Return the hit/miss counts of this worker and the number and size of the entries."""
+        entries = 0
+        size = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                try:
+                    size += entry.stat().st_size
+                    entries += 1
+                except OSError:
+                    pass  # Pruned while scanning
+        return {
+            "backend": "disk",
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+class RedisCache:
+    def __init__(self, url, ttl=3600):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the value stored under key, or None."""
+        data = self.client.get(f"docker-dash:{key}")
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        """Store value under key for ttl seconds."""
+        self.client.set(f"docker-dash:{key}", pickle.dumps(value), ex=self.ttl)
+
+    def stats(self):
+        """Return the hit/miss counts of this worker and the number and size of the entries."""
+        entries = 0
+        size = 0
+        for key in self.client.scan_iter(match="docker-dash:*"):
+            entries += 1
+            size += self.client.memory_usage(key) or 0
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+def create_cache():
+    """Create the graph cache configured through the environment."""
+    redis_url = os.environ.get("DOCKER_DASH_REDIS_URL")
+    if redis_url:
+        logging.info(f"Using Redis graph cache at {redis_url}")
+        return RedisCache(redis_url)
+    cache = DiskCache(
+        os.environ.get("DOCKER_DASH_CACHE_DIR"),
+        max_bytes=int(os.environ.get("DOCKER_DASH_CACHE_MAX_MB", 32)) * 1024 * 1024,
+    )
+    logging.info(f"Using disk graph cache in {cache.directory}")
+    return cache
@@ -0,0 +1,92 @@
+"""
+ip_resolver.py
+
+This module defines the IPResolver class, a prefix trie used to find the owner of an IP address
+by longest-prefix match over a set of CIDR ranges.
+
+It is shared by the discovery script (dd.py) and the DataProcessor. Ranges come from the IPAM
+subnets of Docker networks and, optionally, from a user-provided CIDR -> owner map.
+
+Notes:
+- The trie is binary (one level per address bit), so a lookup walks at most 32 nodes for IPv4
+  and 128 for IPv6 no matter how many ranges are loaded.
+- Each trie node is a 3 item list: [zero child, one child, owner].
+- This module only depends on the standard library so dd.py can import it directly.
+"""
+
+import ipaddress
+import json
+import os
+
+GATEWAY_SUFFIX = " (Gateway)"
+
+
+def load_cidr_owners(path):
+    """Load a JSON {cidr: owner} map from path, returning an empty map if the file doesn't exist."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class IPResolver:
+    def __init__(self, ranges=None, fallback=None):
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        self.gateways = {}
+        self.fallback = fallback  # Another resolver consulted for ranges this one doesn't cover
+        for cidr, owner in (ranges or {}).items():
+            self.insert(cidr, owner)
+
+    def insert(self, cidr, owner):
+        """Add a CIDR range and its owner. Invalid ranges are ignored."""
+        try:
+            network = ipaddress.ip_network(cidr, strict=False)
+        except ValueError:
+            return
+        node = self._roots[network.version]
+        max_prefixlen = network.max_prefixlen
+        value = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (value >> (max_prefixlen - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        node[2] = owner
+
+    def add_network(self, name, subnet=None, gateway=None):
+        """Add a Docker network's subnet and gateway."""
+        if subnet:
+            self.insert(subnet, name)
+        if gateway:
+            self.gateways[gateway] = name + GATEWAY_SUFFIX
+
+    def match(self, ip):
+        """Return (prefix length, owner) of the longest range containing ip, or (-1, None)."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return -1, None
+        node = self._roots[address.version]
+        max_prefixlen = address.max_prefixlen
+        value = int(address)
+        best = (0, node[2]) if node[2] is not None else (-1, None)
+        for i in range(max_prefixlen):
+            node = node[(value >> (max_prefixlen - 1 - i)) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                best = (i + 1, node[2])
+
+        if self.fallback:
+            fallback_best = self.fallback.match(ip)
+            if fallback_best[0] > best[0]:
+                best = fallback_best
+        return best
+
+    def lookup(self, ip):
+        """Return the owner of ip, or None if no range contains it."""
+        return self.match(ip)[1]
+
+    def is_gateway(self, ip):
+        """Check to see if ip is the gateway of a known Docker network."""
+        return ip in self.gateways
@@ -16,6 +16,7 @@ Notes:
 from dash import html, dcc
 import dash_cytoscape as cyto
 from styles import stylesheet
+from filters import PROTOCOLS, STATES
 from datetime import datetime
 
 
@@ -126,14 +127,39 @@ def create_layout(elements):
                                 style={"marginRight": "8px"},
                             ),
                             dcc.Download(id="export-graph"),
+                            html.Button(
+                                "Analytics",
+                                id="analytics-button",
+                                style={"marginRight": "8px"},
+                            ),
+                            dcc.Input(
+                                id="diff-time-input",
+                                type="text",
+                                placeholder="Diff at (e.g. 2026-01-31T14:00)",
+                                style={"width": "200px"},
+                            ),
+                            html.Button(
+                                "Diff",
+                                id="diff-button",
+                                style={"marginLeft": "10px", "marginRight": "8px"},
+                            ),
                             dcc.Input(
                                 id="node-search",
                                 type="text",
-                                placeholder="Search node...",
-                                debounce=False,
-                                style={"width": "160px", "marginRight": "8px"},
+                                placeholder="Search node, port 5432, image postgres...",
+                                debounce=0.3,
+                                style={"width": "220px", "marginRight": "8px"},
                             ),
                             dcc.Store(id="base-styles", data=stylesheet),
+                            dcc.Store(id="search-results"),
+                            dcc.Checklist(
+                                id="live-toggle",
+                                options=[{"label": "Live", "value": "live"}],
+                                value=[],
+                                style={"marginRight": "8px"},
+                            ),
+                            dcc.Interval(id="live-interval", interval=5000, disabled=True),
+                            dcc.Store(id="graph-version"),
                         ],
                         style={
                             "display": "flex",
@@ -150,6 +176,68 @@ def create_layout(elements):
                 },
                 className="app-header",
             ),
+            # --- Filters (applied by Load, Diff and Live) ---
+            html.Div(
+                [
+                    html.Label("Filters:", style={"marginRight": "8px"}),
+                    dcc.Dropdown(
+                        id="proto-filter",
+                        options=PROTOCOLS,
+                        multi=True,
+                        placeholder="Protocol",
+                        className="app-filter",
+                    ),
+                    dcc.Dropdown(
+                        id="state-filter",
+                        options=STATES,
+                        multi=True,
+                        placeholder="State",
+                        className="app-filter",
+                    ),
+                    dcc.Input(
+                        id="port-filter",
+                        type="text",
+                        placeholder="Ports (e.g. 80,443,8000-9000)",
+                        style={"width": "200px", "marginRight": "8px"},
+                    ),
+                    dcc.Dropdown(
+                        id="stack-filter",
+                        multi=True,
+                        placeholder="Stacks",
+                        className="app-filter",
+                    ),
+                    dcc.Dropdown(
+                        id="device-filter",
+                        multi=True,
+                        placeholder="Devices",
+                        className="app-filter",
+                    ),
+                    # --- Focus on the neighbourhood of the clicked or searched node ---
+                    html.Label("Focus:", style={"marginLeft": "8px", "marginRight": "8px"}),
+                    dcc.Input(
+                        id="focus-hops",
+                        type="number",
+                        min=1,
+                        value=2,
+                        style={"width": "50px", "marginRight": "8px"},
+                    ),
+                    dcc.Dropdown(
+                        id="focus-direction",
+                        options=[
+                            {"label": "Both ways", "value": "both"},
+                            {"label": "Outbound", "value": "out"},
+                            {"label": "Inbound", "value": "in"},
+                        ],
+                        value="both",
+                        clearable=False,
+                        className="app-filter",
+                    ),
+                    html.Button("Focus", id="focus-button", style={"marginRight": "8px"}),
+                    html.Button("Clear", id="clear-focus-button"),
+                    dcc.Store(id="focus-node"),
+                ],
+                className="app-filters",
+            ),
             # --- Body ---
             html.Div(
                 [
@@ -0,0 +1,125 @@
+"""
+search_index.py
+
+This module defines the SearchIndex class, an inverted index over the metadata of the nodes of a
+processed graph, used by the node search box in Docker Dash.
+
+Each indexed value (container name, image, stack, IP, listen port, process name or node label)
+is a term with a posting set of the node ids it belongs to. A trigram index over the terms makes
+substring (and prefix) matching a set intersection instead of a scan over every node.
+
+Notes:
+- Queries are whitespace separated clauses that must all match. A clause may be qualified with
+  a field, e.g. "port 5432", "image postgres" or "image:postgres"; unqualified clauses match
+  any field.
+- The index is built once per graph (see `build_search_index`) and stored in the graph cache.
+"""
+
+import re
+
+SEARCH_FIELDS = ("name", "image", "stack", "ip", "port", "process")
+
+
+def _trigrams(term):
+    return {term[i : i + 3] for i in range(len(term) - 2)}
+
+
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}  # term -> {field -> set of node ids}
+        self.trigrams = {}  # trigram -> set of terms
+
+    def add(self, node_id, field, value):
+        """Index value under field for node_id."""
+        if value is None or value == "":
+            return
+        term = str(value).lower()
+        fields = self.postings.get(term)
+        if fields is None:
+            fields = self.postings[term] = {}
+            for trigram in _trigrams(term):
+                self.trigrams.setdefault(trigram, set()).add(term)
+        fields.setdefault(field, set()).add(node_id)
+
+    def _matching_terms(self, text):
+        """Return the indexed terms containing text."""
+        trigrams = _trigrams(text)
+        if not trigrams:
+            return [term for term in self.postings if text in term]  # Too short for trigrams
+        candidates = None
+        for trigram in sorted(trigrams, key=lambda t: len(self.trigrams.get(t, ()))):
+            terms = self.trigrams.get(trigram)
+            if not terms:
+                return []
+            candidates = set(terms) if candidates is None else candidates & terms
+            if not candidates:
+                return []
+        return [term for term in candidates if text in term]
+
+    def _search_clause(self, field, text):
+        ids = set()
+        for term in self._matching_terms(text):
+            for term_field, term_ids in self.postings[term].items():
+                if field is None or term_field == field:
+                    ids |= term_ids
+        return ids
+
+    def search(self, query):
+        """Return the sorted ids of the nodes matching every clause of query."""
+        tokens = (query or "").lower().split()
+        clauses = []
+        i = 0
+        while i < len(tokens):
+            match = re.match(r"^([a-z]+):(.+)$", tokens[i])
+            if match and match.group(1) in SEARCH_FIELDS:
+                clauses.append((match.group(1), match.group(2)))
+                i += 1
+            elif tokens[i] in SEARCH_FIELDS and i + 1 < len(tokens):
+                clauses.append((tokens[i], tokens[i + 1]))
+                i += 2
+            else:
+                clauses.append((None, tokens[i]))
+                i += 1
+
+        ids = None
+        for field, text in clauses:
+            clause_ids = self._search_clause(field, text)
+            ids = clause_ids if ids is None else ids & clause_ids
+            if not ids:
+                return []
+        return sorted(ids or [])
+
+
+def build_search_index(elements, containers):
+    """Build a SearchIndex over the nodes in elements and the metadata of containers."""
+    index = SearchIndex()
+    node_ids = set()
+    for element in elements:
+        if element.get("group") != "nodes":
+            continue
+        data = element["data"]
+        node_id = data["id"]
+        node_ids.add(node_id)
+        index.add(node_id, "name", data.get("label"))
+        if node_id.startswith("i__"):
+            index.add(node_id, "ip", node_id[3:])
+        elif node_id.startswith("p__"):
+            index.add(node_id, "process", node_id[3:])
+
+    for container in containers:
+        node_id = f"c__{container.get('name')}"
+        if node_id not in node_ids:
+            continue
+        index.add(node_id, "image", container.get("image"))
+        index.add(node_id, "stack", container.get("stack"))
+        for ip in container.get("ip_addresses") or []:
+            index.add(node_id, "ip", ip)
+        for port in container.get("listen_ports") or []:
+            index.add(node_id, "port", port)
+        for connection in container.get("connections") or []:
+            pid_program_name = connection.get("pid_program_name")
+            if pid_program_name:
+                index.add(node_id, "process", pid_program_name.split("/")[-1])
+        if container.get("stack"):
+            index.add(f"s__{container.get('stack')}", "stack", container.get("stack"))
+    return index
@@ -74,4 +74,41 @@ stylesheet = [
             "font-weight": "normal",
         },
     },
+    # Compound node grouping foreign IPs by the owner of their range
+    {
+        "selector": ".owners",
+        "style": {
+            "background-color": "#EDE7E7",
+            "content": "data(label)",
+            "text-valign": "top",
+            "color": "#735050",
+            "font-size": 10,
+            "shape": "roundrectangle",
+            "text-margin-y": -3,
+            "font-weight": "normal",
+        },
+    },
+    # Diff mode: elements that appeared, disappeared or stayed between the two windows
+    {"selector": "edge.diff-unchanged", "style": {"opacity": 0.4}},
+    {
+        "selector": "node.diff-added",
+        "style": {"border-color": "#2E9E44", "border-width": 2},
+    },
+    {
+        "selector": "node.diff-removed",
+        "style": {"border-color": "#D2042D", "border-width": 2, "border-style": "dashed"},
+    },
+    {
+        "selector": "edge.diff-added",
+        "style": {"line-color": "#2E9E44", "target-arrow-color": "#2E9E44", "width": 1},
+    },
+    {
+        "selector": "edge.diff-removed",
+        "style": {
+            "line-color": "#D2042D",
+            "target-arrow-color": "#D2042D",
+            "line-style": "dashed",
+            "width": 1,
+        },
+    },
 ]
@@ -4,6 +4,8 @@ utils.py
 This module contains general utility functions used across the Docker Dash application.
 """
 
+from datetime import datetime, timezone
+
 
 def coalesce(*args):
     """Return the first argument that is not None."""
@@ -31,6 +33,47 @@ def make_edge(id, source, target):
     return edge
 
 
+def add_classes(element, classes):
+    """Return a copy of a cytoscape element with classes appended to its existing classes."""
+    existing = element.get("classes")
+    return {**element, "classes": f"{existing} {classes}" if existing else classes}
+
+
+def subgraph(elements, node_ids):
+    """Return the elements of the nodes in node_ids, their parents and the edges between them."""
+    node_ids = set(node_ids)
+    parents = {
+        e["data"]["parent"]
+        for e in elements
+        if e["data"]["id"] in node_ids and e["data"].get("parent")
+    }
+    return [
+        e
+        for e in elements
+        if e["data"]["id"] in node_ids
+        or e["data"]["id"] in parents
+        or (
+            e.get("group") == "edges"
+            and e["data"]["source"] in node_ids
+            and e["data"]["target"] in node_ids
+        )
+    ]
+
+
+def to_snapshot_time(value):
+    """Parse a user supplied date/time and return it in the snapshot_time format (UTC ISO 8601).
+
+    Times without a timezone are taken as UTC. Returns None if value can't be parsed.
+    """
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+
 def anonymize_ip(ip):
     """Take a IP as input and return a anonymized one"""
     if "." in ip:
@@ -42,3 +85,8 @@ def anonymize_ip(ip):
             octets.append("X")
             return ".".join(str(octet) for octet in octets)
     return ip
+
+
+def strip_connections(device):
+    """Return a copy of a device/process dictionary without its connections and listen ports."""
+    return {k: v for k, v in device.items() if k not in ("connections", "listen_ports")}
@@ -0,0 +1,23 @@
+"""
+wsgi.py
+
+WSGI entry point for serving Docker Dash in production, e.g.:
+
+    gunicorn --workers 4 --bind 0.0.0.0:8050 wsgi:server
+
+Notes:
+- Each worker builds its own DashApp; processed graphs are shared between workers through the
+  graph cache (see graph_cache.py), so any worker can answer any callback.
+- The graph cache is configured with the DOCKER_DASH_CACHE_DIR / DOCKER_DASH_REDIS_URL
+  environment variables.
+- Set DOCKER_DASH_DATA_SOURCE=edges to read the edges written by `dd.py mongo --edges`.
+"""
+
+from app import DashApp
+
+dash_app = DashApp(
+    dev_mode=False,
+    mask_ip_labels=False,
+    hide_procs_with_no_inbound=False,
+)
+server = dash_app.app.server
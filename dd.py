@@ -9,20 +9,135 @@ It can output data either to stdout as JSON or insert it into a MongoDB collecti
 Notes:
 - Connections are filtered to exclude local-only traffic (e.g., 127.0.0.1 or "::").
 - Each device dictionary contains all metadata and a list of its connections.
+- Containers sharing a network namespace (network_mode container:/service:, pods, sidecars) are
+  scanned once; sockets are attributed to the owning container where the pid allows it.
 - Designed to be run as a standalone script to generate snapshots for Docker Dash.
 - Command-line argument "mongo" switches output from stdout to MongoDB insertion.
+- With "mongo --edges", distinct edges are upserted into the `edges` collection (with first_seen,
+  last_seen and hit counts) and device metadata into `devices`, instead of inserting a full
+  snapshot document. Each run is recorded in the small `passes` collection.
+- With "--conntrack", container connections are read from the host's connection tracking table
+  (/proc/net/nf_conntrack, or `conntrack -L` when that file isn't available) in a single pass
+  instead of entering every network namespace. This sees the bridged and NATed flows tracked in
+  the host namespace, including short-lived ones netstat would miss. "--cross-check" also runs
+  the per-namespace scan and reports the differences between the two on stderr.
+- Every command, docker API call and /proc read goes through CollectorIO. "--record <dir>" saves
+  their raw results and "--replay <dir>" feeds them back through the same parsing code without
+  docker, sudo or network access. "--bench N" times N collections, e.g. over a replayed run.
 """
 
+import argparse
 import docker
+import ipaddress
 import json
+import os
+import socket
 import sys
 import subprocess
 import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-
-mongo = False
-if len(sys.argv) > 1 and sys.argv[1] == "mongo":
-    mongo = True
+from dash_app.ip_resolver import IPResolver, load_cidr_owners, GATEWAY_SUFFIX
+
+INSPECT_WORKERS = 16  # Concurrent container inspects, and connections pooled for them
+CIDR_OWNERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cidr_owners.json")
+CONNTRACK_PATH = "/proc/net/nf_conntrack"
+# conntrack tcp states that netstat names differently
+CONNTRACK_STATES = {
+    "SYN_SENT": "SYN_SEND",
+    "SYN_RECV": "SYN_RECEIVED",
+    "FIN_WAIT": "FIN_WAIT_1",
+    "CLOSE": "CLOSED",
+}
+
+
+# Source of every raw input the collector parses: command outputs, docker API responses and /proc
+# reads. Results are saved to <record_dir>/run.json when recording and read back from
+# <replay_dir>/run.json when replaying.
+class CollectorIO:
+    def __init__(self, record_dir=None, replay_dir=None):
+        self.record_dir = record_dir
+        self.replay_dir = replay_dir
+        self.recorded = {"commands": {}, "docker": {}, "files": {}}
+        self.docker_client = None
+        if replay_dir:
+            with open(os.path.join(replay_dir, "run.json"), "r") as f:
+                self.recorded = json.load(f)
+
+    def _replayed(self, section, key):
+        try:
+            return self.recorded[section][key]
+        except KeyError:
+            raise RuntimeError(f"{key!r} was not recorded in {self.replay_dir}") from None
+
+    def check_output(self, cmd, **kwargs):
+        key = " ".join(cmd)
+        if self.replay_dir:
+            return self._replayed("commands", key).encode("utf-8", "surrogateescape")
+        output = subprocess.check_output(cmd, **kwargs)
+        if self.record_dir:
+            self.recorded["commands"][key] = output.decode("utf-8", "surrogateescape")
+        return output
+
+    def docker_api(self, name, *args):
+        key = " ".join([name, *args])
+        if self.replay_dir:
+            return self._replayed("docker", key)
+        if self.docker_client is None:
+            self.docker_client = docker.from_env(max_pool_size=INSPECT_WORKERS)
+        response = getattr(self.docker_client.api, name)(*args)
+        if self.record_dir:
+            self.recorded["docker"][key] = response
+        return response
+
+    # Files that can't be read are recorded as None and raise OSError again when replayed
+    def read_file(self, path):
+        if self.replay_dir:
+            content = self._replayed("files", path)
+            if content is None:
+                raise FileNotFoundError(path)
+            return content
+        try:
+            with open(path, "r") as f:
+                content = f.read()
+        except OSError:
+            content = None
+            raise
+        finally:
+            if self.record_dir:
+                self.recorded["files"][path] = content
+        return content
+
+    def stat_inode(self, path):
+        key = f"inode:{path}"
+        if self.replay_dir:
+            inode = self._replayed("files", key)
+            if inode is None:
+                raise FileNotFoundError(path)
+            return inode
+        try:
+            inode = os.stat(path).st_ino
+        except OSError:
+            inode = None
+            raise
+        finally:
+            if self.record_dir:
+                self.recorded["files"][key] = inode
+        return inode
+
+    def close(self):
+        if self.docker_client is not None:
+            self.docker_client.close()
+            self.docker_client = None
+        if self.record_dir:
+            os.makedirs(self.record_dir, exist_ok=True)
+            with open(os.path.join(self.record_dir, "run.json"), "w") as f:
+                json.dump(self.recorded, f)
+
+
+collector_io = CollectorIO()
 
 
 # Get Host Process Data using ss command
@@ -30,7 +145,7 @@ def get_processes():
     ss_cmd = ["sudo", "ss", "-tanp", "state", "established"]
     re_proc_pid_pat = r'\("([^"]+)",pid=(\d+),fd=\d+\)'
 
-    ss_cmd_output = subprocess.check_output(ss_cmd)
+    ss_cmd_output = collector_io.check_output(ss_cmd)
 
     process_set = {}
     ss_split_lines = str(ss_cmd_output).split("\\n")
@@ -93,8 +208,26 @@ def get_processes():
     return process_set
 
 
-# Get docker container data using docker client / netstat
-def get_containers():
+# Get the inode of the network namespace a process lives in (identical for processes sharing it)
+def get_netns_inode(pid):
+    try:
+        return collector_io.stat_inode(f"/proc/{pid}/ns/net")
+    except OSError:
+        return None
+
+
+# Get the full id of the docker container a host process belongs to using its cgroup path
+def get_pid_container_id(pid):
+    try:
+        cgroup = collector_io.read_file(f"/proc/{pid}/cgroup")
+    except OSError:
+        return None
+    match = re.search(r"[0-9a-f]{64}", cgroup)
+    return match.group(0) if match else None
+
+
+# Get connections inside the network namespace of a pid using nsenter / netstat
+def get_netstat_connections(pid):
     NETSTAT_STATES = [
         "CLOSE_WAIT",
         "CLOSED",
@@ -108,11 +241,250 @@ def get_containers():
         "TIME_WAIT",
     ]
 
-    client = docker.from_env()
-    info = client.info()
-    containers = client.containers.list()
-    networks = client.networks.list()
-    client.close()
+    nsenter_netstat_cmd = [
+        "sudo",
+        "nsenter",
+        "-t",
+        str(pid),
+        "-n",
+        "netstat",
+        "-anp",
+    ]
+    # print(" ".join(nsenter_netstat_cmd)) # Print line for writing the raw command out
+    nsenter_netstat_cmd_output = collector_io.check_output(nsenter_netstat_cmd)
+    netstat_split_lines = str(nsenter_netstat_cmd_output).split("\\n")
+    connections = []
+    for line in netstat_split_lines:
+        if line.find("tcp") != -1 or line.find("udp") != -1:
+            connection = {}
+            split_line = line.split()
+            split_line_length = len(split_line)
+
+            proto = split_line[0] if split_line_length >= 1 else None
+            local_address = split_line[3] if split_line_length >= 4 else None
+            foreign_address = split_line[4] if split_line_length >= 5 else None
+            state = split_line[5] if split_line_length >= 6 else None
+            pid_program_name = split_line[6] if split_line_length >= 7 else None
+
+            local_address_split = local_address.split(":")
+            local_ip = "::" if local_address[0:2] == "::" else local_address_split[0]
+            local_port = local_address_split[len(local_address_split) - 1]
+
+            foreign_address_split = foreign_address.split(":")
+            foreign_ip = "::" if foreign_address[0:2] == "::" else foreign_address_split[0]
+            foreign_port = foreign_address_split[len(foreign_address_split) - 1]
+
+            if pid_program_name is None and state not in NETSTAT_STATES:
+                pid_program_name = state
+                state = None
+            if pid_program_name == "-":
+                pid_program_name = None
+
+            connection.update(
+                {
+                    "proto": proto,
+                    "local_address": local_address,
+                    "local_ip": local_ip,
+                    "local_port": local_port,
+                    "foreign_address": foreign_address,
+                    "foreign_ip": foreign_ip,
+                    "foreign_port": foreign_port,
+                    "state": state,
+                    "pid_program_name": pid_program_name,
+                }
+            )
+
+            # Ommit local connections
+            if local_ip != foreign_ip and foreign_ip != "0.0.0.0":
+                connections.append(connection)
+    return connections
+
+
+# Split the connections of a shared network namespace between the containers that share it.
+# Sockets are attributed to a container through the cgroup of the owning pid; sockets that
+# can't be attributed are attached to every container in the namespace.
+def attribute_connections(connections, members):
+    members_by_id = {member["_full_id"]: member for member in members}
+    pid_container_ids = {}
+    for connection in connections:
+        owner = None
+        pid_program_name = connection.get("pid_program_name")
+        if pid_program_name and "/" in pid_program_name:
+            pid = pid_program_name.split("/")[0]
+            if pid not in pid_container_ids:
+                pid_container_ids[pid] = get_pid_container_id(pid)
+            owner = members_by_id.get(pid_container_ids[pid])
+
+        if owner:
+            owner["connections"].append(connection)
+        else:
+            for member in members:
+                member["connections"].append(connection)
+
+
+# Read the flows in the host's connection tracking table.
+# Each line holds the original direction (client -> destination) followed by the reply direction
+# (server -> client), which differs from the original one when the flow was NATed.
+def read_conntrack():
+    try:
+        lines = collector_io.read_file(CONNTRACK_PATH).splitlines()
+    except OSError:
+        conntrack_cmd = ["sudo", "conntrack", "-L"]
+        lines = collector_io.check_output(conntrack_cmd, stderr=subprocess.DEVNULL)
+        lines = lines.decode().splitlines()
+
+    flows = []
+    for line in lines:
+        split_line = line.split()
+        proto_index = next((i for i, t in enumerate(split_line) if t in ("tcp", "udp")), None)
+        if proto_index is None:
+            continue
+        proto = split_line[proto_index]
+        state = None
+        if proto == "tcp" and len(split_line) > proto_index + 3:
+            state = split_line[proto_index + 3]
+            state = CONNTRACK_STATES.get(state, state) if state.isupper() else None
+
+        flow = {"proto": proto, "state": state}
+        for token in split_line:
+            key, _, value = token.partition("=")
+            if key in ("src", "dst", "sport", "dport"):
+                flow.setdefault(key if key not in flow else f"reply_{key}", value)
+        if all(k in flow for k in ("src", "dst", "sport", "dport", "reply_src", "reply_sport")):
+            flows.append(flow)
+    return flows
+
+
+# Return the canonical (compressed) form of an ip, so e.g. the fully expanded IPv6 addresses in
+# /proc/net/nf_conntrack match the ones docker reports. Anything else is returned as it is.
+def normalize_ip(ip):
+    try:
+        return ipaddress.ip_address(ip).compressed
+    except ValueError:
+        return ip
+
+
+# Map conntrack flows to the containers on either end through their ips.
+# The client side is the original source; the server side is the reply source, i.e. the real
+# container behind a published port. Flows tell us which side is the server, so the server port
+# is also returned as a listen port.
+def get_conntrack_connections(flows, ip_device_set):
+    ip_device_set = {normalize_ip(ip): name for ip, name in ip_device_set.items()}
+    connections = {}
+    listen_ports = {}
+    seen = set()
+    for flow in flows:
+        flow = {
+            key: normalize_ip(value) if key in ("src", "dst", "reply_src", "reply_dst") else value
+            for key, value in flow.items()
+        }
+        proto = flow["proto"] + ("6" if ":" in flow["src"] else "")
+        ends = []
+        client = ip_device_set.get(flow["src"])
+        if client:
+            ends.append((client, flow["src"], flow["sport"], flow["dst"], flow["dport"]))
+        server = ip_device_set.get(flow["reply_src"])
+        if server:
+            reply_dst = flow.get("reply_dst", flow["src"])
+            reply_dport = flow.get("reply_dport", flow["sport"])
+            ends.append((server, flow["reply_src"], flow["reply_sport"], reply_dst, reply_dport))
+            listen_ports.setdefault(server, set()).add(int(flow["reply_sport"]))
+
+        for name, local_ip, local_port, foreign_ip, foreign_port in ends:
+            key = (name, proto, local_ip, local_port, foreign_ip, foreign_port)
+            if local_ip == foreign_ip or key in seen:
+                continue
+            seen.add(key)
+            connections.setdefault(name, []).append(
+                {
+                    "proto": proto,
+                    "local_address": f"{local_ip}:{local_port}",
+                    "local_ip": local_ip,
+                    "local_port": local_port,
+                    "foreign_address": f"{foreign_ip}:{foreign_port}",
+                    "foreign_ip": foreign_ip,
+                    "foreign_port": foreign_port,
+                    "state": flow["state"],
+                    "pid_program_name": None,
+                }
+            )
+    return connections, listen_ports
+
+
+# Compare the connections found in conntrack with the ones found by the per-namespace scan
+def cross_check_connections(devices, conntrack_connections):
+    def keys(name, connections):
+        return {
+            (name, c["local_ip"], str(c["local_port"]), c["foreign_ip"], str(c["foreign_port"]))
+            for c in connections
+            if c.get("state") != "LISTEN"
+        }
+
+    netstat_keys = set()
+    conntrack_keys = set()
+    for device in devices:
+        netstat_keys |= keys(device["name"], device["connections"])
+        conntrack_keys |= keys(device["name"], conntrack_connections.get(device["name"], []))
+
+    print(
+        f"Conntrack cross-check: {len(netstat_keys & conntrack_keys)} in both, "
+        f"{len(conntrack_keys - netstat_keys)} conntrack only, "
+        f"{len(netstat_keys - conntrack_keys)} netstat only",
+        file=sys.stderr,
+    )
+    for key in sorted(netstat_keys - conntrack_keys)[:20]:
+        print(f"  netstat only: {key[0]} {key[1]}:{key[2]} -> {key[3]}:{key[4]}", file=sys.stderr)
+
+
+# Get host, network and container metadata from the docker API with as few round-trips as possible.
+# Containers and networks are each listed in a single call; the list endpoint doesn't return the pid
+# (or the configured image), so those are the only fields read from the per-container inspects,
+# which run concurrently.
+def get_docker_metadata():
+    info = collector_io.docker_api("info")
+    networks = collector_io.docker_api("networks")
+    summaries = collector_io.docker_api("containers")
+    with ThreadPoolExecutor(max_workers=INSPECT_WORKERS) as executor:
+        inspections = list(
+            executor.map(
+                lambda id: collector_io.docker_api("inspect_container", id),
+                [s["Id"] for s in summaries],
+            )
+        )
+
+    if not collector_io.replay_dir:
+        api_calls = 3 + len(summaries)
+        print(
+            f"Docker API calls: {api_calls} (info: 1, networks: 1, containers: 1, inspect: {len(summaries)})",
+            file=sys.stderr,
+        )
+
+    containers = []
+    for summary, inspection in zip(summaries, inspections):
+        listen_ports = []
+        for port in summary.get("Ports") or []:
+            if port.get("PrivatePort") not in listen_ports:
+                listen_ports.append(port.get("PrivatePort"))
+        networks_settings = (summary.get("NetworkSettings") or {}).get("Networks") or {}
+        containers.append(
+            {
+                "id": summary["Id"],
+                "name": summary["Names"][0].lstrip("/"),
+                "image": inspection["Config"]["Image"],
+                "pid": inspection["State"]["Pid"],
+                "stack": (summary.get("Labels") or {}).get("com.docker.compose.project"),
+                "listen_ports": listen_ports,
+                "ip_addresses": [
+                    n["IPAddress"] for n in networks_settings.values() if n.get("IPAddress")
+                ],
+            }
+        )
+    return info, networks, containers
+
+
+# Get docker container data using docker client / netstat (or conntrack)
+def get_containers(conntrack=False, cross_check=False):
+    info, networks, containers = get_docker_metadata()
 
     host = {
         "name": info["Name"],
@@ -121,94 +493,32 @@ def get_containers():
         "ram": round(info["MemTotal"] / 1024 / 1024 / 1024, 2),
     }
 
-    network_name_set = {}
+    # Resolve foreign ips by longest-prefix match over docker subnets and user supplied ranges
+    resolver = IPResolver(fallback=IPResolver(load_cidr_owners(CIDR_OWNERS_PATH)))
+    network_list = []
     for network in networks:
-        network_config = network.attrs.get("IPAM").get("Config")
-        if network_config:
-            gateway = network_config[0].get("Gateway")
-            if gateway:
-                name = network.name
-                network_name_set[gateway] = name + " (Gateway)"
+        network_config = (network.get("IPAM") or {}).get("Config")
+        for config in network_config or []:
+            subnet = config.get("Subnet")
+            gateway = config.get("Gateway")
+            resolver.add_network(network["Name"], subnet=subnet, gateway=gateway)
+            network_list.append({"name": network["Name"], "subnet": subnet, "gateway": gateway})
+    network_name_set = resolver.gateways
 
     ip_device_set = {}
     devices = []
+    namespaces = {}
     for container in containers:
-        name = container.name
-        id = container.short_id
-        image = container.attrs.get("Config").get("Image")
-        pid = container.attrs.get("State").get("Pid")
-        stack = container.attrs.get("Config").get("Labels").get("com.docker.compose.project")
-        ip_addresses = []
-        connections = []
-        listen_ports = []
+        name = container["name"]
+        id = container["id"][:12]
+        image = container["image"]
+        pid = container["pid"]
+        stack = container["stack"]
+        ip_addresses = container["ip_addresses"]
+        listen_ports = container["listen_ports"]
 
-        network_settings = container.attrs.get("NetworkSettings")
-        ports = network_settings.get("Ports").keys()
-        for port in ports:
-            listen_port = int(port[:-4])
-            listen_ports.append(listen_port)
-
-        networks = network_settings.get("Networks").values()
-        for network in networks:
-            ip_address = network["IPAddress"]
-            ip_device_set[ip_address] = container.name
-            ip_addresses.append(ip_address)
-
-        nsenter_netstat_cmd = [
-            "sudo",
-            "nsenter",
-            "-t",
-            str(pid),
-            "-n",
-            "netstat",
-            "-anp",
-        ]
-        # print(" ".join(nsenter_netstat_cmd)) # Print line for writing the raw command out
-        nsenter_netstat_cmd_output = subprocess.check_output(nsenter_netstat_cmd)
-        netstat_split_lines = str(nsenter_netstat_cmd_output).split("\\n")
-        for line in netstat_split_lines:
-            if line.find("tcp") != -1 or line.find("udp") != -1:
-                connection = {}
-                split_line = line.split()
-                split_line_length = len(split_line)
-
-                proto = split_line[0] if split_line_length >= 1 else None
-                local_address = split_line[3] if split_line_length >= 4 else None
-                foreign_address = split_line[4] if split_line_length >= 5 else None
-                state = split_line[5] if split_line_length >= 6 else None
-                pid_program_name = split_line[6] if split_line_length >= 7 else None
-
-                local_address_split = local_address.split(":")
-                local_ip = "::" if local_address[0:2] == "::" else local_address_split[0]
-                local_port = local_address_split[len(local_address_split) - 1]
-
-                foreign_address_split = foreign_address.split(":")
-                foreign_ip = "::" if foreign_address[0:2] == "::" else foreign_address_split[0]
-                foreign_port = foreign_address_split[len(foreign_address_split) - 1]
-
-                if pid_program_name is None and state not in NETSTAT_STATES:
-                    pid_program_name = state
-                    state = None
-                if pid_program_name == "-":
-                    pid_program_name = None
-
-                connection.update(
-                    {
-                        "proto": proto,
-                        "local_address": local_address,
-                        "local_ip": local_ip,
-                        "local_port": local_port,
-                        "foreign_address": foreign_address,
-                        "foreign_ip": foreign_ip,
-                        "foreign_port": foreign_port,
-                        "state": state,
-                        "pid_program_name": pid_program_name,
-                    }
-                )
-
-                # Ommit local connections
-                if local_ip != foreign_ip and foreign_ip != "0.0.0.0":
-                    connections.append(connection)
+        for ip_address in ip_addresses:
+            ip_device_set[ip_address] = name
 
         # Craft the device dictionary
         device = {}
@@ -221,30 +531,220 @@ def get_containers():
                 "pid": pid,
                 "ip_addresses": ip_addresses,
                 "listen_ports": listen_ports,
-                "connections": connections,
+                "connections": [],
+                "_full_id": container["id"],
             }
         )
         devices.append(device)
 
+        # Group containers by network namespace (network_mode container:/service:, pods, sidecars)
+        netns = get_netns_inode(pid)
+        namespaces.setdefault(netns if netns is not None else f"pid:{pid}", []).append(device)
+
+    # Scan each network namespace exactly once and attach the result to every container sharing it
+    for members in namespaces.values() if not conntrack or cross_check else []:
+        connections = get_netstat_connections(members[0]["pid"])
+        if len(members) == 1:
+            members[0]["connections"] = connections
+        else:
+            attribute_connections(connections, members)
+            shared_ips = [ip for member in members for ip in member["ip_addresses"]]
+            for member in members:
+                if not member["ip_addresses"]:
+                    member["ip_addresses"] = list(shared_ips)
+
+    # Or read every container's flows from the host's conntrack table at once
+    if conntrack:
+        conntrack_connections, conntrack_listen_ports = get_conntrack_connections(
+            read_conntrack(), ip_device_set
+        )
+        if cross_check:
+            cross_check_connections(devices, conntrack_connections)
+        for device in devices:
+            device["connections"] = conntrack_connections.get(device["name"], [])
+            for port in sorted(conntrack_listen_ports.get(device["name"], [])):
+                if port not in device["listen_ports"]:
+                    device["listen_ports"].append(port)
+
+    for device in devices:
+        device.pop("_full_id", None)
+
     # Loop through all the connections and update them to include the name of the container matching the foreign ip
+    # If there is no matching container or gateway, record the owner of the range the ip falls in instead
     for device in devices:
         connections = device.get("connections")
         for connection in connections:
             foreign_ip = connection.get("foreign_ip")
             foreign_device = None
+            foreign_owner = None
             if foreign_ip != "::" and foreign_ip != "0.0.0.0" and foreign_ip != "127.0.0.1":
                 if foreign_ip in network_name_set:
                     foreign_device = network_name_set.get(foreign_ip)
                 else:
                     foreign_device = ip_device_set.get(foreign_ip)
-            connection.update({"foreign_device": foreign_device})
-    return devices, network_name_set
+                if foreign_device is None:
+                    foreign_owner = resolver.lookup(foreign_ip)
+            connection.update({"foreign_device": foreign_device, "foreign_owner": foreign_owner})
+    return devices, network_name_set, network_list, resolver
+
+
+# Reduce the connections of a run to distinct directed edges keyed by (host, source, target, port, proto)
+# Direction follows the dashboard: a connection on one of the device's listen ports is inbound.
+def get_edges(host_name, devices, processes, network_name_set):
+    edges = {}
+
+    def add_edges(name, kind, listen_ports, connections):
+        for c in connections:
+            foreign_device = c.get("foreign_device")
+            if foreign_device and foreign_device.endswith(GATEWAY_SUFFIX):
+                local_ip = c.get("local_ip")
+                peer = local_ip if local_ip in network_name_set else c.get("foreign_ip")
+                peer_kind = "gateway"
+            elif foreign_device:
+                peer, peer_kind = foreign_device, "container"
+            else:
+                peer, peer_kind = c.get("foreign_ip"), "ip"
+
+            try:
+                local_port = int(c.get("local_port"))
+                foreign_port = int(c.get("foreign_port"))
+            except (TypeError, ValueError):
+                continue
+            if local_port in listen_ports:
+                source, source_kind, target, target_kind = peer, peer_kind, name, kind
+                port = local_port
+            else:
+                source, source_kind, target, target_kind = name, kind, peer, peer_kind
+                port = foreign_port
+
+            key = (host_name, source, target, port, c.get("proto"))
+            if key not in edges:
+                edges[key] = {
+                    "source_kind": source_kind,
+                    "target_kind": target_kind,
+                    "peer_label": foreign_device,
+                    "owner": c.get("foreign_owner"),
+                }
 
+    for device in devices or []:
+        add_edges(device["name"], "container", device["listen_ports"], device["connections"])
+    for name, process in (processes or {}).items():
+        add_edges(name, "process", process["listen_ports"], process["connections"])
+    return edges
+
+
+# Upsert the edges and devices of a run instead of storing a full snapshot document
+def upsert_edges(db, host_name, snapshot_time, edges, devices, processes):
+    from pymongo import ASCENDING, UpdateOne
+
+    db["edges"].create_index(
+        [(k, ASCENDING) for k in ("host", "source", "target", "port", "proto")], unique=True
+    )
+    db["edges"].create_index("last_seen")
+    db["devices"].create_index([("host", ASCENDING), ("kind", ASCENDING), ("name", ASCENDING)])
+    db["passes"].create_index("snapshot_time")
+
+    edge_ops = []
+    for (host, source, target, port, proto), edge in edges.items():
+        edge_ops.append(
+            UpdateOne(
+                {"host": host, "source": source, "target": target, "port": port, "proto": proto},
+                {
+                    "$setOnInsert": {
+                        "first_seen": snapshot_time,
+                        "source_kind": edge["source_kind"],
+                        "target_kind": edge["target_kind"],
+                    },
+                    "$set": {"peer_label": edge["peer_label"], "owner": edge["owner"]},
+                    "$max": {"last_seen": snapshot_time},
+                    "$inc": {"hits": 1},
+                },
+                upsert=True,
+            )
+        )
 
-def main():
+    device_ops = []
+    for kind, items in [
+        ("container", [(d["name"], d) for d in devices or []]),
+        ("process", list((processes or {}).items())),
+    ]:
+        for name, item in items:
+            metadata = {k: v for k, v in item.items() if k != "connections"}
+            device_ops.append(
+                UpdateOne(
+                    {"host": host_name, "kind": kind, "name": name},
+                    {
+                        "$setOnInsert": {"first_seen": snapshot_time},
+                        "$set": {**metadata, "last_seen": snapshot_time},
+                    },
+                    upsert=True,
+                )
+            )
+
+    if edge_ops:
+        db["edges"].bulk_write(edge_ops, ordered=False)
+    if device_ops:
+        db["devices"].bulk_write(device_ops, ordered=False)
+    db["passes"].insert_one(
+        {"host": host_name, "snapshot_time": snapshot_time, "edges": len(edge_ops)}
+    )
+    return len(edge_ops), len(device_ops)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Docker Dash discovery script")
+    parser.add_argument(
+        "output",
+        nargs="?",
+        choices=["stdout", "mongo"],
+        default="stdout",
+        help="print the snapshot as JSON (default) or write it to MongoDB",
+    )
+    parser.add_argument(
+        "--edges",
+        action="store_true",
+        help="with mongo output, upsert distinct edges and devices instead of a full snapshot",
+    )
+    parser.add_argument(
+        "--conntrack",
+        action="store_true",
+        help="read container connections from the host conntrack table instead of netstat",
+    )
+    parser.add_argument(
+        "--cross-check",
+        action="store_true",
+        help="with --conntrack, also scan every namespace and report the differences on stderr",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="save the raw command outputs, docker API responses and /proc reads of this run",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="DIR",
+        help="parse the inputs saved by --record instead of reading live ones",
+    )
+    parser.add_argument(
+        "--bench",
+        metavar="N",
+        type=int,
+        help="time N collection passes and report them on stderr instead of outputting a snapshot",
+    )
+    args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record and --replay can't be used together")
+    if args.bench is not None and args.bench < 1:
+        parser.error("--bench must be at least 1")
+    return args
+
+
+# Run one collection pass. Returns the host dictionary and the parts of it get_edges needs.
+def collect(args):
     processes = None
     devices = None
     network_name_set = None
+    resolver = None
 
     discover_processes = True
     discover_containers = True
@@ -258,27 +758,70 @@ def main():
         processes = get_processes()
         host["processes"] = processes
     if discover_containers:
-        devices, network_name_set = get_containers()
+        devices, network_name_set, network_list, resolver = get_containers(
+            conntrack=args.conntrack, cross_check=args.cross_check
+        )
         host["devices"] = devices
+        host["networks"] = network_list
 
-    if processes and network_name_set:
+    if processes and resolver:
         for v in processes.values():
             for c in v["connections"]:
                 if c["local_ip"] in network_name_set:
                     c["foreign_device"] = network_name_set[c["local_ip"]]
+                else:
+                    c["foreign_owner"] = resolver.lookup(c["foreign_ip"])
+    return host, devices, processes, network_name_set
+
+
+# Time repeated collection passes (usually over a --replay directory) and report them on stderr
+def bench(args):
+    timings = []
+    for _ in range(args.bench):
+        start = time.perf_counter()
+        collect(args)
+        timings.append(time.perf_counter() - start)
+    print(
+        f"Collected {len(timings)} times: "
+        f"min {min(timings) * 1000:.1f} ms, "
+        f"median {statistics.median(timings) * 1000:.1f} ms, "
+        f"mean {statistics.mean(timings) * 1000:.1f} ms",
+        file=sys.stderr,
+    )
+
+
+def main():
+    global collector_io
+    args = parse_args()
+    collector_io = CollectorIO(record_dir=args.record, replay_dir=args.replay)
+    try:
+        if args.bench:
+            bench(args)
+            return
+        host, devices, processes, network_name_set = collect(args)
+    finally:
+        collector_io.close()
 
     snapshot_time = datetime.now(timezone.utc).isoformat()
     payload = {"snapshot_time": snapshot_time, "host": host}
 
-    if mongo:
+    if args.output == "mongo":
         from pymongo import MongoClient
 
         conn_str = "mongodb://localhost:27017/"
         client = MongoClient(conn_str)
         db = client["dashdb"]
-        collection = db["snapshots"]
-        result = collection.insert_one(payload)
-        print("Inserted document ID:", result.inserted_id)
+        if args.edges:
+            host_name = socket.gethostname()
+            edges = get_edges(host_name, devices, processes, network_name_set or {})
+            edge_count, device_count = upsert_edges(
+                db, host_name, snapshot_time, edges, devices, processes
+            )
+            print(f"Upserted {edge_count} edges and {device_count} devices")
+        else:
+            collection = db["snapshots"]
+            result = collection.insert_one(payload)
+            print("Inserted document ID:", result.inserted_id)
 
     else:
         print(json.dumps(payload, indent=2))